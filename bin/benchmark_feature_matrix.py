@@ -0,0 +1,78 @@
+"""A micro-benchmark of the feature matrix row gathering.
+
+Compares gathering the training voxels of a multi-component GLCM composite image with numpy masked arrays (the former
+implementation of ``FeatureExtractor._image_as_numpy_array``) and with flat voxel indices from a view of the image.
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+import SimpleITK as sitk
+
+try:
+    import mialab.utilities.pipeline_utilities as putil
+except ImportError:
+    # Append the MIALab root directory to Python path
+    sys.path.insert(0, os.path.join(os.path.dirname(sys.argv[0]), '..'))
+    import mialab.utilities.pipeline_utilities as putil
+
+
+def masked_array_gather(image: sitk.Image, mask: np.ndarray) -> np.ndarray:
+    """Gathers the voxels with numpy masked arrays, where the mask is True for the voxels not to gather."""
+    number_of_components = image.GetNumberOfComponentsPerPixel()
+    image_arr = sitk.GetArrayFromImage(image)
+    no_voxels = np.size(mask) - np.count_nonzero(mask)
+
+    if number_of_components == 1:
+        masked_image = np.ma.masked_array(image_arr, mask=mask)
+    else:
+        vector_mask = np.repeat(np.expand_dims(mask, axis=3), number_of_components, axis=3)
+        masked_image = np.ma.masked_array(image_arr, mask=vector_mask)
+
+    return masked_image[~masked_image.mask].reshape((no_voxels, number_of_components))
+
+
+def main(size: int, components: int, fraction: float, repeat: int):
+    """Runs the benchmark."""
+    rng = np.random.default_rng(0)
+    shape = (size, size, size)
+
+    # a GLCM composite image and a sparse training mask
+    image = sitk.GetImageFromArray(rng.random(shape + (components,), dtype=np.float32), isVector=True)
+    training_mask = rng.random(shape) < fraction
+    print('Image of {} voxels with {} components, {} training voxels'.format(
+        np.prod(shape), components, np.count_nonzero(training_mask)))
+
+    mask = np.logical_not(training_mask)
+    indices = np.flatnonzero(training_mask)
+    out = np.empty((len(indices), components + 2), dtype=np.float32)
+
+    def flat_index_gather():
+        # indices are computed once per image, hence not timed
+        return putil.FeatureExtractor._image_as_numpy_array(image, indices, out=out[:, 1:-1])
+
+    if not np.array_equal(masked_array_gather(image, mask), flat_index_gather()):
+        raise ValueError('the gathered rows differ')
+
+    times = {}
+    for name, function in (('masked array', lambda: masked_array_gather(image, mask)),
+                           ('flat index', flat_index_gather)):
+        times[name] = min(timeit.repeat(function, number=1, repeat=repeat))
+        print(' {:<13} {:.4f} s'.format(name + ':', times[name]))
+    print(' Speedup: {:.1f}x'.format(times['masked array'] / times['flat index']))
+
+
+if __name__ == '__main__':
+    """The program's entry point."""
+
+    parser = argparse.ArgumentParser(description='Micro-benchmark of the feature matrix row gathering')
+    parser.add_argument('--size', type=int, default=128, help='Edge length of the cubic image.')
+    parser.add_argument('--components', type=int, default=24, help='Number of GLCM features.')
+    parser.add_argument('--fraction', type=float, default=0.01, help='Fraction of training voxels.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of repetitions.')
+
+    args = parser.parse_args()
+    main(args.size, args.components, args.fraction, args.repeat)
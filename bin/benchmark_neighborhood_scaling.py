@@ -0,0 +1,63 @@
+"""A scaling benchmark of the process-parallel NeighborhoodFeatureExtractor.
+
+Executes the extractor on a random image with an increasing number of worker processes, each computing the features of
+a z-slab of the image in shared memory, and reports the speedup over a single process.
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+import SimpleITK as sitk
+
+try:
+    import mialab.filtering.feature_extraction as fltr_feat
+except ImportError:
+    # Append the MIALab root directory to Python path
+    sys.path.insert(0, os.path.join(os.path.dirname(sys.argv[0]), '..'))
+    import mialab.filtering.feature_extraction as fltr_feat
+
+
+def main(size: int, backend: str, max_processes: int, repeat: int):
+    """Runs the benchmark."""
+    rng = np.random.default_rng(0)
+    image = sitk.GetImageFromArray(rng.random((size, size, size), dtype=np.float32))
+    if backend == 'batched':
+        function_, batched, backend = fltr_feat.first_order_texture_features_function_batched, True, 'numpy'
+    else:
+        function_, batched = fltr_feat.first_order_texture_features_function, False
+    print('Image of {} voxels, {} backend, {} CPUs'.format(size ** 3, backend + (' (batched)' if batched else ''),
+                                                           os.cpu_count()))
+
+    reference = None
+    times = {}
+    processes = 1
+    while processes <= max_processes:
+        extractor = fltr_feat.NeighborhoodFeatureExtractor(function_=function_, backend=backend, batched=batched,
+                                                           processes=processes)
+        result = sitk.GetArrayFromImage(extractor.execute(image))  # also spawns the workers
+        if reference is None:
+            reference = result
+        elif not np.array_equal(reference, result, equal_nan=True):
+            raise ValueError('the features of {} processes differ'.format(processes))
+
+        times[processes] = min(timeit.repeat(lambda: extractor.execute(image), number=1, repeat=repeat))
+        print(' {:>2} processes: {:.3f} s, speedup {:.2f}x'.format(processes, times[processes],
+                                                                   times[1] / times[processes]))
+        processes *= 2
+
+
+if __name__ == '__main__':
+    """The program's entry point."""
+
+    parser = argparse.ArgumentParser(description='Scaling benchmark of the NeighborhoodFeatureExtractor')
+    parser.add_argument('--size', type=int, default=64, help='Edge length of the cubic image.')
+    parser.add_argument('--backend', type=str, default='batched', choices=['batched', 'numpy'],
+                        help='Backend of the first-order texture features.')
+    parser.add_argument('--max_processes', type=int, default=os.cpu_count(), help='Maximum number of processes.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of repetitions.')
+
+    args = parser.parse_args()
+    main(args.size, args.backend, args.max_processes, args.repeat)
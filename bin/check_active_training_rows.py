@@ -0,0 +1,45 @@
+"""A check of the uncertainty-driven active selection of the training rows.
+
+Selects the training rows of a random, separable training set with row budgets larger and smaller than the seed
+sample and checks that the budget is kept, no row is selected twice, and that the seed sample covers all labels.
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+try:
+    import mialab.utilities.training_set as tset
+except ImportError:
+    # Append the MIALab root directory to Python path
+    sys.path.insert(0, os.path.join(os.path.dirname(sys.argv[0]), '..'))
+    import mialab.utilities.training_set as tset
+
+
+def main(number_of_rows: int, seed: int):
+    """Runs the check."""
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(0, 6, number_of_rows).astype(np.int16)
+    data = labels[:, np.newaxis] + rng.normal(0, 1, (number_of_rows, 4))
+
+    for row_budget, seed_size in ((300, 25), (10, 25), (150, 25), (3, 25)):
+        rows = tset.select_active_training_rows(data, labels, row_budget, seed_size, step_size=20, n_estimators=5,
+                                                max_depth=5, rng=np.random.default_rng(seed))
+        if rows.size != row_budget or np.unique(rows).size != rows.size:
+            raise AssertionError('{} rows selected for a budget of {}'.format(rows.size, row_budget))
+        if row_budget >= 6 and np.unique(labels[rows]).size != 6:
+            raise AssertionError('the rows of a budget of {} miss labels'.format(row_budget))
+        print(' budget {}, seed size {}: {} rows selected'.format(row_budget, seed_size, rows.size))
+
+
+if __name__ == '__main__':
+    """The program's entry point."""
+
+    parser = argparse.ArgumentParser(description='Check of the active selection of the training rows')
+    parser.add_argument('--rows', type=int, default=2000, help='Number of candidate rows.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random training set.')
+
+    args = parser.parse_args()
+    main(args.rows, args.seed)
@@ -0,0 +1,112 @@
+"""A check of the multi-process pre-processing with the feature cache and memory-mapped feature matrices.
+
+Writes small synthetic subjects to a temporary directory and pre-processes them with ``multi_process=True`` and the
+feature cache (once filling the cache and once loading from it) as well as with the feature matrices written to
+memory-mapped files (``feature_matrix_dir``), and checks that the feature matrices equal the ones of the sequential
+pre-processing. With a random seed, also the sampled training voxels need to be reproduced by the worker processes.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+import SimpleITK as sitk
+
+try:
+    import mialab.data.structure as structure
+    import mialab.utilities.pipeline_utilities as putil
+except ImportError:
+    # Append the MIALab root directory to Python path
+    sys.path.insert(0, os.path.join(os.path.dirname(sys.argv[0]), '..'))
+    import mialab.data.structure as structure
+    import mialab.utilities.pipeline_utilities as putil
+
+
+def write_subject(directory: str, id_: str, shape: tuple, seed: int) -> dict:
+    """Writes a synthetic subject of spherical labels and gets its paths as returned by the data crawler."""
+    rng = np.random.default_rng(seed)
+    z, y, x = np.indices(shape)
+    radius = np.sqrt(sum((axis - size / 2) ** 2 for axis, size in zip((z, y, x), shape)))
+    brain_mask = (radius < min(shape) / 2.5).astype(np.uint8)
+    ground_truth = np.digitize(radius, [2, 4, 5, 7, min(shape) / 2.5]).astype(np.uint8)
+    ground_truth = np.where(brain_mask > 0, 5 - ground_truth, 0).astype(np.uint8)
+    t1w = (ground_truth * 20 + rng.normal(0, 3, shape)) * brain_mask
+    t2w = (100 - ground_truth * 15 + rng.normal(0, 3, shape)) * brain_mask
+
+    subject_dir = os.path.join(directory, id_)
+    os.makedirs(subject_dir, exist_ok=True)
+    paths = {id_: subject_dir}
+    for image_type, arr in ((structure.BrainImageTypes.T1w, t1w.astype(np.float32)),
+                            (structure.BrainImageTypes.T2w, t2w.astype(np.float32)),
+                            (structure.BrainImageTypes.GroundTruth, ground_truth),
+                            (structure.BrainImageTypes.BrainMask, brain_mask)):
+        paths[image_type] = os.path.join(subject_dir, image_type.name + '.mha')
+        sitk.WriteImage(sitk.GetImageFromArray(arr), paths[image_type])
+    paths[structure.BrainImageTypes.RegistrationTransform] = os.path.join(subject_dir, 'affine.txt')
+    sitk.WriteTransform(sitk.AffineTransform(3), paths[structure.BrainImageTypes.RegistrationTransform])
+    return paths
+
+
+def pre_process(data: dict, params: dict, multi_process: bool) -> dict:
+    """Pre-processes the subjects and gets their feature matrices by identifier."""
+    # pre_process consumes the paths, pass a copy
+    images = putil.pre_process_batch({id_: dict(paths) for id_, paths in data.items()}, params,
+                                     multi_process=multi_process)
+    return {img.id_: tuple(np.asarray(arr) for arr in img.feature_matrix) for img in images}
+
+
+def check_equal(name: str, reference: dict, feature_matrices: dict):
+    """Checks that the feature matrices equal the reference."""
+    for id_, (data, labels) in reference.items():
+        if not (np.array_equal(data, feature_matrices[id_][0], equal_nan=True) and
+                np.array_equal(labels, feature_matrices[id_][1])):
+            raise AssertionError('{}: the feature matrix of {} differs'.format(name, id_))
+    print(' {}: {} feature matrices equal ({} rows)'.format(name, len(reference),
+                                                             sum(data.shape[0] for data, _ in reference.values())))
+
+
+def main(number_of_subjects: int, size: int, seed: int):
+    """Runs the check."""
+    params = {'coordinates_feature': True,
+              'intensity_feature': True,
+              'gradient_intensity_feature': True,
+              'training': False}
+
+    with tempfile.TemporaryDirectory() as directory:
+        data = {}
+        for idx in range(number_of_subjects):
+            id_ = 'subject{}'.format(idx)
+            data[id_] = write_subject(os.path.join(directory, 'data'), id_, (size, size + 2, size + 1), idx)
+
+        reference = pre_process(data, params, multi_process=False)
+
+        cache_params = dict(params, feature_cache_dir=os.path.join(directory, 'cache'))
+        check_equal('multi-process, feature cache miss', reference, pre_process(data, cache_params, True))
+        check_equal('multi-process, feature cache hit', reference, pre_process(data, cache_params, True))
+
+        matrix_params = dict(params, feature_matrix_dir=os.path.join(directory, 'features'))
+        check_equal('multi-process, memory-mapped feature matrix', reference, pre_process(data, matrix_params, True))
+
+        # the training voxels are drawn from the random number generators of the subjects (see get_subject_rng),
+        # such that the sampling is independent of the processes
+        training_params = dict(params, training=True, random_seed=seed, label_percentages=[0.1] * 6,
+                               feature_cache_dir=os.path.join(directory, 'training_cache'),
+                               feature_matrix_dir=os.path.join(directory, 'training_features'))
+        reference = pre_process(data, dict(training_params, feature_cache_dir=None), multi_process=False)
+        check_equal('multi-process, seeded training voxels', reference, pre_process(data, training_params, True))
+        check_equal('multi-process, seeded training voxels from the feature cache', reference,
+                    pre_process(data, training_params, True))
+
+
+if __name__ == '__main__':
+    """The program's entry point."""
+
+    parser = argparse.ArgumentParser(description='Check of the multi-process pre-processing')
+    parser.add_argument('--subjects', type=int, default=2, help='Number of synthetic subjects.')
+    parser.add_argument('--size', type=int, default=20, help='Edge length of the synthetic images.')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the training voxel sampling.')
+
+    args = parser.parse_args()
+    main(args.subjects, args.size, args.seed)
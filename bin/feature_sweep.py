@@ -0,0 +1,239 @@
+"""A feature ablation sweep of the medical image analysis pipeline.
+
+The sweep extracts the union of all candidate texture features once per image and trains and evaluates one decision
+forest per feature subset (the baseline features plus one texture feature of both the T1w and T2w image) by selecting
+the corresponding columns of the feature matrices. The results are written to
+``<result_dir>/{GLCM,FOF,GLSZM}/<feature>/``, as read by ``Table_generator.py`` and the boxplot scripts.
+"""
+import argparse
+import concurrent.futures
+import os
+import shutil
+import sys
+import timeit
+
+import SimpleITK as sitk
+import sklearn.ensemble as sk_ensemble
+import numpy as np
+import pymia.data.conversion as conversion
+import pymia.evaluation.writer as writer
+
+try:
+    import mialab.data.structure as structure
+    import mialab.utilities.file_access_utilities as futil
+    import mialab.utilities.pipeline_utilities as putil
+except ImportError:
+    # Append the MIALab root directory to Python path
+    sys.path.insert(0, os.path.join(os.path.dirname(sys.argv[0]), '..'))
+    import mialab.data.structure as structure
+    import mialab.utilities.file_access_utilities as futil
+    import mialab.utilities.pipeline_utilities as putil
+
+LOADING_KEYS = [structure.BrainImageTypes.T1w,
+                structure.BrainImageTypes.T2w,
+                structure.BrainImageTypes.GroundTruth,
+                structure.BrainImageTypes.BrainMask,
+                structure.BrainImageTypes.RegistrationTransform]  # the list of data we will load
+
+# the candidate features of each texture feature type, where the key is the result directory name
+# and the value is the feature type name of the FeatureExtractor and the features
+CANDIDATE_FEATURES = {
+    'GLCM': ('GLCM', ['Autocorrelation', 'ClusterProminence', 'ClusterShade', 'ClusterTendency', 'Contrast',
+                      'Correlation', 'DifferenceAverage', 'DifferenceEntropy', 'DifferenceVariance', 'Id', 'Idm',
+                      'Idmn', 'Idn', 'Imc1', 'Imc2', 'InverseVariance', 'JointEnergy', 'JointEntropy',
+                      'MaximumProbability', 'SumEntropy', 'SumSquares']),
+    'FOF': ('FO', ['10Percentile', '90Percentile', 'Energy', 'Entropy', 'InterquartileRange', 'Kurtosis', 'Maximum',
+                   'MeanAbsoluteDeviation', 'Mean', 'Median', 'Minimum', 'Range', 'RootMeanSquared', 'Skewness',
+                   'TotalEnergy', 'Uniformity', 'Variance']),
+    'GLSZM': ('GLSZM', ['GrayLevelNonUniformity', 'GrayLevelNonUniformityNormalized', 'GrayLevelVariance',
+                        'HighGrayLevelZoneEmphasis', 'LargeAreaEmphasis', 'LargeAreaHighGrayLevelEmphasis',
+                        'LargeAreaLowGrayLevelEmphasis', 'LowGrayLevelZoneEmphasis', 'SizeZoneNonUniformity',
+                        'SizeZoneNonUniformityNormalized', 'SmallAreaEmphasis', 'SmallAreaHighGrayLevelEmphasis',
+                        'SmallAreaLowGrayLevelEmphasis', 'ZoneEntropy', 'ZonePercentage', 'ZoneVariance'])
+}
+
+
+def get_feature_subsets(feature_names: list) -> dict:
+    """Gets the feature matrix columns of the feature subsets.
+
+    Args:
+        feature_names (list): The names of the feature matrix columns (see ``BrainImage.feature_names``).
+
+    Returns:
+        dict: The feature subsets, where the key is a tuple of the feature type and the feature (or 'Baseline')
+        and the value are the column indices.
+    """
+    prefixes = ['{}_{}_'.format(modality, feature_type)
+                for feature_type, _ in CANDIDATE_FEATURES.values() for modality in ('T1w', 'T2w')]
+
+    texture_columns = {}
+    baseline = []
+    for column, name in enumerate(feature_names):
+        prefix = next((prefix for prefix in prefixes if name.startswith(prefix)), None)
+        if prefix is None:
+            baseline.append(column)
+        else:
+            feature_type = prefix.split('_')[1]
+            texture_columns.setdefault((feature_type, name[len(prefix):]), []).append(column)
+
+    subsets = {}
+    for directory, (feature_type, features) in CANDIDATE_FEATURES.items():
+        subsets[(directory, 'Baseline')] = baseline
+        for feature in features:
+            subsets[(directory, feature)] = baseline + texture_columns[(feature_type, feature)]
+    return subsets
+
+
+def train_and_evaluate(columns: list, images: list, images_test: list, result_dir: str, forest_params: dict):
+    """Trains and evaluates a decision forest on a subset of the features.
+
+    Args:
+        columns (list): The feature matrix columns to use.
+        images (list): The pre-processed training images.
+        images_test (list): The pre-processed testing images.
+        result_dir (str): The directory to write the results to.
+        forest_params (dict): The parameters of the decision forest.
+    """
+    data_train = np.concatenate([img.feature_matrix[0].take(columns, axis=1) for img in images])
+    labels_train = np.concatenate([img.feature_matrix[1] for img in images]).squeeze()
+
+    forest = sk_ensemble.RandomForestClassifier(max_features=len(columns), **forest_params)
+    forest.fit(data_train, labels_train)
+
+    evaluator = putil.init_evaluator()
+    os.makedirs(result_dir, exist_ok=True)
+    for img in images_test:
+        data_test = img.feature_matrix[0].take(columns, axis=1)
+        predictions = putil.scatter_roi(forest.predict(data_test), img)
+        probabilities = forest.predict_proba(data_test)
+        probabilities = putil.scatter_roi(probabilities, img, np.eye(probabilities.shape[1])[0])
+
+        image_prediction = conversion.NumpySimpleITKImageBridge.convert(predictions.astype(np.uint8),
+                                                                        img.image_properties)
+        image_probabilities = conversion.NumpySimpleITKImageBridge.convert(probabilities, img.image_properties)
+        image_post_processed = putil.post_process(img, image_prediction, image_probabilities, simple_post=True)
+
+        evaluator.evaluate(image_prediction, img.images[structure.BrainImageTypes.GroundTruth], img.id_)
+        evaluator.evaluate(image_post_processed, img.images[structure.BrainImageTypes.GroundTruth], img.id_ + '-PP')
+
+    writer.CSVWriter(os.path.join(result_dir, 'results.csv')).write(evaluator.results)
+    functions = {'MEAN': np.mean, 'STD': np.std}
+    writer.CSVStatisticsWriter(os.path.join(result_dir, 'results_summary.csv'),
+                               functions=functions).write(evaluator.results)
+
+
+def main(result_dir: str, data_atlas_dir: str, data_train_dir: str, data_test_dir: str, workers: int):
+    """Feature ablation sweep of the brain tissue segmentation using decision forests."""
+
+    # use of random seed for better reproducibility:
+    random_seed = 51
+    np.random.seed(random_seed)
+
+    # load atlas images
+    putil.load_atlas_images(data_atlas_dir)
+
+    # extract the union of all candidate features once
+    pre_process_params = {'skullstrip_pre': True,
+                          'normalization_pre': True,
+                          'registration_pre': True,
+                          'coordinates_feature': True,
+                          'intensity_feature': True,
+                          'gradient_intensity_feature': True,
+                          'texture_backend': 'native',
+                          'sparse_texture': True,
+                          'feature_workers': 2,
+                          'roi_crop': True,
+                          'roi_padding': 3,
+                          'feature_cache_dir': os.path.join(result_dir, 'feature-cache'),
+                          'feature_cache_size': 20 * 1024 ** 3,
+                          'random_seed': random_seed}
+    for feature_type, features in CANDIDATE_FEATURES.values():
+        pre_process_params[feature_type + '_features'] = True
+        pre_process_params[feature_type + '_features_parameters'] = {feature: True for feature in features}
+    forest_params = {'n_estimators': 50, 'max_depth': 60, 'random_state': random_seed}
+
+    print('-' * 5, 'Feature extraction...')
+    crawler = futil.FileSystemDataCrawler(data_train_dir, LOADING_KEYS, futil.BrainImageFilePathGenerator(),
+                                          futil.DataDirectoryFilter())
+    images = putil.pre_process_batch(crawler.data, pre_process_params, multi_process=False)
+
+    crawler = futil.FileSystemDataCrawler(data_test_dir, LOADING_KEYS, futil.BrainImageFilePathGenerator(),
+                                          futil.DataDirectoryFilter())
+    pre_process_params['training'] = False
+    images_test = putil.pre_process_batch(crawler.data, pre_process_params, multi_process=False)
+
+    # the baseline is the same for all feature types, train it only once
+    subsets = get_feature_subsets(images[0].feature_names)
+    jobs = {}
+    for (directory, feature), columns in subsets.items():
+        jobs.setdefault(tuple(columns), []).append(os.path.join(result_dir, directory, feature))
+
+    print('-' * 5, 'Training and testing', len(jobs), 'feature subsets...')
+    start_time = timeit.default_timer()
+
+    def run(columns, result_dirs):
+        train_and_evaluate(list(columns), images, images_test, result_dirs[0], forest_params)
+        for other_dir in result_dirs[1:]:
+            os.makedirs(other_dir, exist_ok=True)
+            for file_name in ('results.csv', 'results_summary.csv'):
+                shutil.copy(os.path.join(result_dirs[0], file_name), other_dir)
+        print(' Done:', ', '.join(result_dirs))
+
+    # SimpleITK filters are multi-threaded themselves, share the threads between the workers
+    default_threads = sitk.ProcessObject.GetGlobalDefaultNumberOfThreads()
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(max(1, default_threads // workers))
+    try:
+        # the forests are trained and evaluated by threads, which share the feature matrices without copying them
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(run, columns, result_dirs) for columns, result_dirs in jobs.items()]:
+                future.result()
+    finally:
+        sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(default_threads)
+
+    print(' Time elapsed:', timeit.default_timer() - start_time, 's')
+
+
+if __name__ == "__main__":
+    """The program's entry point."""
+
+    script_dir = os.path.dirname(sys.argv[0])
+
+    parser = argparse.ArgumentParser(description='Feature ablation sweep of the medical image analysis pipeline')
+
+    parser.add_argument(
+        '--result_dir',
+        type=str,
+        default=os.path.normpath(os.path.join(script_dir, './mia-result')),
+        help='Directory for results.'
+    )
+
+    parser.add_argument(
+        '--data_atlas_dir',
+        type=str,
+        default=os.path.normpath(os.path.join(script_dir, '../data/atlas')),
+        help='Directory with atlas data.'
+    )
+
+    parser.add_argument(
+        '--data_train_dir',
+        type=str,
+        default=os.path.normpath(os.path.join(script_dir, '../data/train/')),
+        help='Directory with training data.'
+    )
+
+    parser.add_argument(
+        '--data_test_dir',
+        type=str,
+        default=os.path.normpath(os.path.join(script_dir, '../data/test/')),
+        help='Directory with testing data.'
+    )
+
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=os.cpu_count(),
+        help='Number of feature subsets trained and evaluated in parallel.'
+    )
+
+    args = parser.parse_args()
+    main(args.result_dir, args.data_atlas_dir, args.data_train_dir, args.data_test_dir, args.workers)
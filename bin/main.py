@@ -20,12 +20,14 @@ try:
     import mialab.data.structure as structure
     import mialab.utilities.file_access_utilities as futil
     import mialab.utilities.pipeline_utilities as putil
+    import mialab.utilities.training_set as tset
 except ImportError:
     # Append the MIALab root directory to Python path
     sys.path.insert(0, os.path.join(os.path.dirname(sys.argv[0]), '..'))
     import mialab.data.structure as structure
     import mialab.utilities.file_access_utilities as futil
     import mialab.utilities.pipeline_utilities as putil
+    import mialab.utilities.training_set as tset
 
 LOADING_KEYS = [structure.BrainImageTypes.T1w,
                 structure.BrainImageTypes.T2w,
@@ -34,7 +36,9 @@ LOADING_KEYS = [structure.BrainImageTypes.T1w,
                 structure.BrainImageTypes.RegistrationTransform]  # the list of data we will load
 
 
-def main(result_dir: str, data_atlas_dir: str, data_train_dir: str, data_test_dir: str):
+def main(result_dir: str, data_atlas_dir: str, data_train_dir: str, data_test_dir: str,
+         texture_backend: str = 'pyradiomics', sparse_texture: bool = False, roi_crop: bool = False,
+         feature_cache_dir: str = None, reservoir_sizes: list = None):
     """Brain tissue segmentation using decision forests.
 
     The main routine executes the medical image analysis pipeline:
@@ -53,6 +57,19 @@ def main(result_dir: str, data_atlas_dir: str, data_train_dir: str, data_test_di
     random_seed = 51
     np.random.seed(random_seed)
 
+    # the training mode, either 'random' (a one-shot random draw of the training voxels) or 'active' (a bounded training
+    # set selected by uncertainty-driven active resampling from a larger random draw of candidate voxels)
+    training_mode = 'random'
+    active_params = {'pool_factor': 5,  # the candidate voxels relative to the random draw
+                     'row_budget': 50000,  # the number of training rows
+                     'seed_size': 500,  # the random rows per label to start with
+                     'step_size': 1000,  # the rows per label added per round
+                     'n_estimators': 10,  # the size of the forest scoring the candidates
+                     'max_depth': 20}
+    label_percentages = [0.0003, 0.004, 0.003, 0.04, 0.04, 0.02]
+    if training_mode == 'active':
+        label_percentages = [min(1.0, percentage * active_params['pool_factor']) for percentage in label_percentages]
+
     # load atlas images
     putil.load_atlas_images(data_atlas_dir)
 
@@ -140,24 +157,57 @@ def main(result_dir: str, data_atlas_dir: str, data_train_dir: str, data_test_di
                           'FO_features_parameters': fo_parameters_list,
                           'GLSZM_features': False,  # Enable GLSZM feature extraction
                           'GLSZM_features_parameters': glszm_parameters_list,
+                          'texture_backend': texture_backend,  # 'pyradiomics' or 'native' (vectorized)
+                          'sparse_texture': sparse_texture,  # texture features only at the training voxels (native)
+                          'feature_workers': 2,  # number of threads extracting independent features concurrently
+                          'roi_crop': roi_crop,  # extract the features only within the bounding box of the brain mask
+                          'roi_padding': 3,  # the number of voxels the bounding box is padded with
+                          'feature_cache_dir': feature_cache_dir,  # None to disable
+                          'feature_cache_size': 20 * 1024 ** 3,  # the maximum size of the feature cache in bytes
+                          'feature_matrix_dir': None,  # memory-map the testing feature matrices to this directory
+                          'random_seed': random_seed,  # training voxels of each subject independent of the order
+                          'training_sampling': 'random',  # 'random' (label percentages) or 'boundary' (label budgets)
+                          'label_budgets': [300, 2000, 2000, 500, 500, 500],  # training voxels per label (boundary)
+                          'label_percentages': label_percentages,  # training voxels per label (random)
                           'n_estimators': 50,
                           'max_depth': 60
                           }
 
     # 'GLCM_features_parameters': glcm_parameters_list,
-    # load images for training and pre-process
-    images = putil.pre_process_batch(crawler.data, pre_process_params, multi_process=False)
-
-    # generate feature matrix and label vector
-    data_train = np.concatenate([img.feature_matrix[0] for img in images])
-    labels_train = np.concatenate([img.feature_matrix[1] for img in images]).squeeze()
+    if reservoir_sizes is None:
+        # load images for training and pre-process
+        images = putil.pre_process_batch(crawler.data, pre_process_params, multi_process=False)
+
+        # generate feature matrix and label vector
+        data_train = np.concatenate([img.feature_matrix[0] for img in images])
+        labels_train = np.concatenate([img.feature_matrix[1] for img in images]).squeeze()
+        del images
+    else:
+        # load images for training and pre-process one by one, and keep a fixed-size random sample of the rows of each
+        # label, such that the memory of the training set is independent of the number of subjects
+        training_set = tset.ReservoirTrainingSet([0, 1, 2, 3, 4, 5], reservoir_sizes,
+                                                 np.random.default_rng(random_seed))
+        for img in putil.pre_process_iter(crawler.data, pre_process_params):
+            training_set.add(img.feature_matrix[0], img.feature_matrix[1], img.feature_names)
+            del img  # release the images before the next subject is processed
+
+        # generate feature matrix and label vector
+        data_train, labels_train = training_set.get()
+
+    if training_mode == 'active':
+        start_time = timeit.default_timer()
+        rows = tset.select_active_training_rows(data_train, labels_train, rng=np.random.default_rng(random_seed),
+                                                **{key: value for key, value in active_params.items()
+                                                   if key != 'pool_factor'})
+        data_train, labels_train = data_train[rows], labels_train[rows]
+        print(' Active resampling time elapsed:', timeit.default_timer() - start_time, 's')
 
     # warnings.warn('Random forest parameters not properly set.')
     # forest = sk_ensemble.RandomForestClassifier(max_features=images[0].feature_matrix[0].shape[1],
     #                                             n_estimators=1,
     #                                             max_depth=5)
 
-    forest = sk_ensemble.RandomForestClassifier(max_features=images[0].feature_matrix[0].shape[1],
+    forest = sk_ensemble.RandomForestClassifier(max_features=data_train.shape[1],
                                                 n_estimators=pre_process_params['n_estimators'],
                                                 max_depth=pre_process_params['max_depth'])
 
@@ -211,6 +261,10 @@ def main(result_dir: str, data_atlas_dir: str, data_train_dir: str, data_test_di
         start_time = timeit.default_timer()
         predictions = forest.predict(img.feature_matrix[0])
         probabilities = forest.predict_proba(img.feature_matrix[0])
+
+        # the voxels outside the region of interest are background
+        predictions = putil.scatter_roi(predictions, img)
+        probabilities = putil.scatter_roi(probabilities, img, np.eye(probabilities.shape[1])[0])
         print(' Time elapsed:', timeit.default_timer() - start_time, 's')
 
         # convert prediction and probabilities back to SimpleITK images
@@ -291,5 +345,42 @@ if __name__ == "__main__":
         help='Directory with testing data.'
     )
 
+    parser.add_argument(
+        '--texture_backend',
+        type=str,
+        default='pyradiomics',
+        choices=['pyradiomics', 'native'],
+        help='Backend of the texture features, pyradiomics or the vectorized native backend.'
+    )
+
+    parser.add_argument(
+        '--sparse_texture',
+        action='store_true',
+        help='Calculate the texture features of the training images only at the training voxels (native backend).'
+    )
+
+    parser.add_argument(
+        '--roi_crop',
+        action='store_true',
+        help='Extract the features only within the padded bounding box of the brain mask.'
+    )
+
+    parser.add_argument(
+        '--feature_cache_dir',
+        type=str,
+        default=None,
+        help='Directory of the persistent feature cache of the pre-processed images (disabled if not set).'
+    )
+
+    parser.add_argument(
+        '--reservoir_sizes',
+        type=int,
+        nargs=6,
+        default=None,
+        help='Maximum number of training rows of each label (0 to 5), sampled by streaming reservoir sampling '
+             '(unbounded if not set), e.g. 20000 200000 200000 50000 50000 50000.'
+    )
+
     args = parser.parse_args()
-    main(args.result_dir, args.data_atlas_dir, args.data_train_dir, args.data_test_dir)
+    main(args.result_dir, args.data_atlas_dir, args.data_train_dir, args.data_test_dir, args.texture_backend,
+         args.sparse_texture, args.roi_crop, args.feature_cache_dir, args.reservoir_sizes)
@@ -0,0 +1,97 @@
+"""A parity test of the native voxel-based texture features against pyradiomics.
+
+Computes the voxel-based first-order, GLCM, and GLSZM features of a small random volume with a partial mask and an
+anisotropic spacing with ``mialab.filtering.texture`` and with the corresponding pyradiomics feature classes
+(``voxelBased=True``), and asserts that each feature map is equal up to floating point tolerances.
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+import numpy as np
+import radiomics
+import SimpleITK as sitk
+from radiomics import firstorder, glcm, glszm
+
+try:
+    import mialab.filtering.texture as tex
+except ImportError:
+    # Append the MIALab root directory to Python path
+    sys.path.insert(0, os.path.join(os.path.dirname(sys.argv[0]), '..'))
+    import mialab.filtering.texture as tex
+
+
+FEATURE_CLASSES = {
+    'firstorder': (firstorder.RadiomicsFirstOrder, tex.VoxelBasedFirstOrder),
+    'glcm': (glcm.RadiomicsGLCM, tex.VoxelBasedGLCM),
+    'glszm': (glszm.RadiomicsGLSZM, tex.VoxelBasedGLSZM),
+}
+
+
+def get_images(shape: tuple, seed: int) -> tuple:
+    """Gets a random image with a flat region and a partial mask, both with an anisotropic spacing."""
+    rng = np.random.default_rng(seed)
+    image_arr = rng.normal(100, 30, shape)
+    image_arr[4:7, 4:7, 4:8] = 77.0  # a flat region, i.e. a single gray level in the kernel
+    mask_arr = np.zeros(shape, np.uint8)
+    mask_arr[1:-1, 1:-2, 2:-1] = 1
+    mask_arr[3, 3, 3] = 0  # a hole
+
+    image = sitk.GetImageFromArray(image_arr)
+    mask = sitk.GetImageFromArray(mask_arr)
+    image.SetSpacing((1.0, 2.0, 1.5))
+    mask.SetSpacing((1.0, 2.0, 1.5))
+    return image, mask
+
+
+def assert_parity(name: str, image: sitk.Image, mask: sitk.Image, rtol: float, atol: float):
+    """Asserts that each feature map of a feature class equals the one of pyradiomics."""
+    reference_class, native_class = FEATURE_CLASSES[name]
+    enabled_features = {feature: True for feature, deprecated in reference_class.getFeatureNames().items()
+                        if not deprecated}
+
+    reference = reference_class(image, mask, voxelBased=True)
+    reference.enabledFeatures = dict(enabled_features)
+    reference_maps = reference.execute()
+
+    native = native_class(image, mask, voxelBased=True)
+    native.enabledFeatures = dict(enabled_features)
+    native_maps = native.execute()
+
+    if list(reference_maps) != list(native_maps):
+        raise AssertionError('{}: the features {} differ from {}'.format(name, list(native_maps),
+                                                                         list(reference_maps)))
+
+    for feature in reference_maps:
+        reference_arr = sitk.GetArrayFromImage(reference_maps[feature])
+        native_arr = sitk.GetArrayFromImage(native_maps[feature])
+        if not np.allclose(native_arr, reference_arr, rtol=rtol, atol=atol, equal_nan=True):
+            raise AssertionError('{}: {} differs by up to {}'.format(name, feature,
+                                                                     np.nanmax(np.abs(native_arr - reference_arr))))
+    print(' {}: {} features equal'.format(name, len(reference_maps)))
+
+
+def main(shape: tuple, seed: int, feature_classes: list, rtol: float, atol: float):
+    """Runs the parity test."""
+    radiomics.setVerbosity(logging.CRITICAL)
+    image, mask = get_images(shape, seed)
+    print('Image of shape {} (z, y, x), pyradiomics {}'.format(shape, radiomics.__version__))
+    for name in feature_classes:
+        assert_parity(name, image, mask, rtol, atol)
+
+
+if __name__ == '__main__':
+    """The program's entry point."""
+
+    parser = argparse.ArgumentParser(description='Parity test of the voxel-based texture features against pyradiomics')
+    parser.add_argument('--shape', type=int, nargs=3, default=[9, 10, 11], help='Shape (z, y, x) of the image.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random image.')
+    parser.add_argument('--features', type=str, nargs='+', default=list(FEATURE_CLASSES),
+                        choices=list(FEATURE_CLASSES), help='Feature classes to test.')
+    parser.add_argument('--rtol', type=float, default=1e-6, help='Relative tolerance of np.allclose.')
+    parser.add_argument('--atol', type=float, default=1e-9, help='Absolute tolerance of np.allclose.')
+
+    args = parser.parse_args()
+    main(tuple(args.shape), args.seed, args.features, args.rtol, args.atol)
@@ -37,7 +37,9 @@ class BrainImage:
             raise ValueError('No images provided')
 
         self.image_properties = conversion.ImageProperties(self.images[list(self.images.keys())[0]])
+        self.roi = None  # the region of interest (index, size) the features are extracted from, None for the image
         self.feature_images = {}
         self.feature_matrix = None  # a tuple (features, labels),
         # where the shape of features is (n, number_of_features) and the shape of labels is (n, 1)
         # with n being the amount of voxels
+        self.feature_names = []  # the names of the feature matrix columns, e.g. 'T1w_GLCM_Contrast'
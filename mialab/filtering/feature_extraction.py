@@ -1,13 +1,59 @@
 """The feature extraction module contains classes for feature extraction."""
+import atexit
+import functools
+from multiprocessing import resource_tracker, shared_memory
 import sys
 
+import multiprocess
 import numpy as np
 import pymia.filtering.filter as fltr
 import SimpleITK as sitk
 
+try:
+    import numba
+except ImportError:
+    numba = None  # the numba backend of the NeighborhoodFeatureExtractor is not available
+
+EPSILON = sys.float_info.epsilon  # to avoid division by zero
+
+
+@functools.lru_cache(maxsize=8)
+def _get_atlas_coordinates(origin: tuple, spacing: tuple, direction: tuple, size: tuple) -> sitk.Image:
+    """Gets the atlas coordinates image of an image geometry, memoized per process.
+
+    Args:
+        origin (tuple): The image origin.
+        spacing (tuple): The image spacing.
+        direction (tuple): The image direction (row-major 3x3 matrix).
+        size (tuple): The image size (x, y, z).
+
+    Returns:
+        sitk.Image: The atlas coordinates image.
+    """
+    x, y, z = size
+    direction_matrix = np.reshape(direction, (3, 3)).astype(np.float32)
+
+    # coordinates = direction^T @ (x, y, z) + origin (the voxel indices are not scaled by the spacing), broadcasted
+    # along each axis without homogeneous coordinates
+    atlas_coords = np.empty((z, y, x, 3), dtype=np.float32)
+    atlas_coords[...] = np.asarray(origin, dtype=np.float32)
+    atlas_coords += np.arange(x, dtype=np.float32)[np.newaxis, np.newaxis, :, np.newaxis] * direction_matrix[0]
+    atlas_coords += np.arange(y, dtype=np.float32)[np.newaxis, :, np.newaxis, np.newaxis] * direction_matrix[1]
+    atlas_coords += np.arange(z, dtype=np.float32)[:, np.newaxis, np.newaxis, np.newaxis] * direction_matrix[2]
+
+    img_out = sitk.GetImageFromArray(atlas_coords, isVector=True)
+    img_out.SetOrigin(origin)
+    img_out.SetSpacing(spacing)
+    img_out.SetDirection(direction)
+    return img_out
+
 
 class AtlasCoordinates(fltr.Filter):
-    """Represents an atlas coordinates feature extractor."""
+    """Represents an atlas coordinates feature extractor.
+
+    The coordinates are computed once per image geometry (origin, spacing, direction and size) and shared by all
+    images on the same grid, e.g. all images registered to the atlas.
+    """
 
     def __init__(self):
         """Initializes a new instance of the AtlasCoordinates class."""
@@ -22,7 +68,8 @@ class AtlasCoordinates(fltr.Filter):
 
         Returns:
             sitk.Image: The atlas coordinates image
-            (a vector image with 3 components, which represent the physical x, y, z coordinates in mm).
+            (a float32 vector image with 3 components, which represent the x, y, z coordinates origin +
+            direction^T @ voxel index, i.e. the voxel indices are not scaled by the spacing and not in mm).
 
         Raises:
             ValueError: If image is not 3-D.
@@ -31,30 +78,9 @@ class AtlasCoordinates(fltr.Filter):
         if image.GetDimension() != 3:
             raise ValueError('image needs to be 3-D')
 
-        x, y, z = image.GetSize()
-
-        # create matrix with homogenous indices in axis 3
-        coords = np.zeros((x, y, z, 4))
-        coords[..., 0] = np.arange(x)[:, np.newaxis, np.newaxis]
-        coords[..., 1] = np.arange(y)[np.newaxis, :, np.newaxis]
-        coords[..., 2] = np.arange(z)[np.newaxis, np.newaxis, :]
-        coords[..., 3] = 1
-
-        # reshape such that each voxel is one row
-        lin_coords = np.reshape(coords, [coords.shape[0] * coords.shape[1] * coords.shape[2], 4])
-
-        # generate transformation matrix
-        tmp_mat = image.GetDirection() + image.GetOrigin()
-        tfm = np.reshape(tmp_mat, [3, 4], order='F')
-        tfm = np.vstack((tfm, [0, 0, 0, 1]))
-
-        atlas_coords = (tfm @ np.transpose(lin_coords))[0:3, :]
-        atlas_coords = np.reshape(np.transpose(atlas_coords), [z, y, x, 3], 'F')
-
-        img_out = sitk.GetImageFromArray(atlas_coords)
-        img_out.CopyInformation(image)
-
-        return img_out
+        # the memoized image is shared, return a (copy-on-write) copy such that it cannot be modified
+        return sitk.Image(_get_atlas_coordinates(image.GetOrigin(), image.GetSpacing(), image.GetDirection(),
+                                                 image.GetSize()))
 
     def __str__(self):
         """Gets a printable string representation.
@@ -92,14 +118,14 @@ def first_order_texture_features_function(values):
             - percentile75th
             - percentile90th
     """
-    eps = sys.float_info.epsilon  # to avoid division by zero
+    eps = EPSILON  # to avoid division by zero (a global constant such that the function can be compiled by numba)
 
     mean = np.mean(values)
     std = np.std(values)
     snr = mean / std if std != 0 else 0
     min_ = np.min(values)
     max_ = np.max(values)
-    num_values = len(values)
+    num_values = values.size  # the number of voxels of the (3-D) neighborhood
     p = values / (np.sum(values) + eps)
     return np.array([mean,
                      np.var(values),  # variance
@@ -121,37 +147,417 @@ def first_order_texture_features_function(values):
                      ])
 
 
+def first_order_texture_features_function_batched(values):
+    """Calculates first-order texture features of a batch of neighborhoods.
+
+    The batched version of :py:func:`first_order_texture_features_function`.
+
+    Args:
+        values (np.array): The values to calculate the first-order texture features from of shape (N, k), i.e. the
+            k values of N neighborhoods.
+
+    Returns:
+        np.array: The first-order texture features of shape (N, 16),
+        in the order of :py:func:`first_order_texture_features_function`.
+    """
+    eps = EPSILON  # to avoid division by zero
+
+    mean = np.mean(values, axis=1)
+    std = np.std(values, axis=1)
+    min_ = np.min(values, axis=1)
+    max_ = np.max(values, axis=1)
+    num_values = values.shape[1]
+    centered = values - mean[:, np.newaxis]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        snr = np.where(std != 0, mean / std, 0)
+        p = values / (np.sum(values, axis=1, keepdims=True) + eps)
+        entropy = np.sum(-p * np.log2(p), axis=1)
+    percentiles = np.percentile(values, [10, 25, 50, 75, 90], axis=1)
+
+    return np.stack([mean,
+                     np.var(values, axis=1),  # variance
+                     std,
+                     np.sqrt(num_values * (num_values - 1)) / (num_values - 2) * np.sum(centered ** 3, axis=1) /
+                     (num_values * std ** 3 + eps),  # adjusted Fisher-Pearson coefficient of skewness
+                     np.sum(centered ** 4, axis=1) / (num_values * std ** 4 + eps),  # kurtosis
+                     entropy,
+                     np.sum(p ** 2, axis=1),  # energy (intensity histogram uniformity)
+                     snr,
+                     min_,
+                     max_,
+                     max_ - min_,
+                     *percentiles
+                     ], axis=1)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_numba_kernel(function_, vector_output: bool, indexed: bool = False):
+    """Compiles a function and the neighborhood loop into a parallel native kernel, memoized per function.
+
+    Args:
+        function_: The function, which needs to be supported by numba (see NeighborhoodFeatureExtractor).
+        vector_output (bool): Whether the function returns a 1-D np.ndarray or a scalar.
+        indexed (bool): Whether the kernel evaluates the function at given voxels only.
+
+    Returns:
+        The kernel, which gets the padded image array, the kernel size (z, y, x) and the output array. An indexed
+        kernel gets the z, y and x indices of the voxels before the output array, which has a row per voxel.
+    """
+    jit_function = numba.njit(function_)
+
+    if indexed:
+        @numba.njit(parallel=True)
+        def kernel(img_arr_padded, z_offset, y_offset, x_offset, z_indices, y_indices, x_indices, values_out):
+            for i in numba.prange(z_indices.shape[0]):
+                zz, yy, xx = z_indices[i], y_indices[i], x_indices[i]
+                values_out[i] = jit_function(img_arr_padded[zz:zz + z_offset, yy:yy + y_offset, xx:xx + x_offset])
+    elif vector_output:
+        @numba.njit(parallel=True)
+        def kernel(img_arr_padded, z_offset, y_offset, x_offset, img_out_arr):
+            z, y, x = img_out_arr.shape[:3]
+            for zz in numba.prange(z):
+                for yy in range(y):
+                    for xx in range(x):
+                        img_out_arr[zz, yy, xx, :] = jit_function(
+                            img_arr_padded[zz:zz + z_offset, yy:yy + y_offset, xx:xx + x_offset])
+    else:
+        @numba.njit(parallel=True)
+        def kernel(img_arr_padded, z_offset, y_offset, x_offset, img_out_arr):
+            z, y, x = img_out_arr.shape
+            for zz in numba.prange(z):
+                for yy in range(y):
+                    for xx in range(x):
+                        img_out_arr[zz, yy, xx] = jit_function(
+                            img_arr_padded[zz:zz + z_offset, yy:yy + y_offset, xx:xx + x_offset])
+
+    return kernel
+
+
+class SlidingHistogramPercentiles:
+    """Represents a neighborhood percentile engine for integer or discretized images.
+
+    Instead of sorting each neighborhood, the engine keeps a histogram of the gray levels of the neighborhoods of a
+    whole image row while the neighborhoods slide along the fastest axis (x), in the style of Huang's median filter:
+    the column entering the neighborhood is added and the leaving column is removed. The percentiles are read from
+    the cumulative histogram and interpolated linearly as by np.percentile. Images with more than 256 gray levels use
+    a two-level histogram, such that reading a percentile scans O(sqrt(levels)) instead of O(levels) bins.
+
+    The histogram pays off for large neighborhoods (e.g. 7x7x7). For small neighborhoods (e.g. 3x3x3), the batched
+    np.percentile of the flattened neighborhoods (``np.percentile(values, percentiles, axis=1).T`` with
+    ``batched=True``) is faster.
+
+    Pass an instance as function to the :class:`NeighborhoodFeatureExtractor` to use the engine. Called with a
+    neighborhood, an instance computes the percentiles with np.percentile.
+    """
+
+    def __init__(self, percentiles=(10, 25, 50, 75, 90), max_levels: int = 4096):
+        """Initializes a new instance of the SlidingHistogramPercentiles class.
+
+        Args:
+            percentiles (tuple): The percentiles to calculate, e.g. (50,) for the median.
+            max_levels (int): The maximum number of gray levels (maximum - minimum + 1) of an image, which bounds the
+                histogram memory. Discretize images with more levels first (e.g. with texture.bin_image).
+        """
+        if len(percentiles) == 0:
+            raise ValueError('at least one percentile is required')
+        self.percentiles = tuple(percentiles)
+        self.max_levels = max_levels
+
+    def __call__(self, values):
+        """Calculates the percentiles of a neighborhood.
+
+        Args:
+            values (np.array): The values of the neighborhood.
+
+        Returns:
+            The percentile if a single percentile is calculated, otherwise a np.array of the percentiles.
+        """
+        if len(self.percentiles) == 1:
+            return np.percentile(values, self.percentiles[0])
+        return np.percentile(values, self.percentiles)
+
+    def execute(self, img_arr_padded: np.ndarray, kernel: tuple, img_out_arr: np.ndarray, slab_size: int = 8):
+        """Calculates the percentiles of the neighborhoods of all voxels.
+
+        Args:
+            img_arr_padded (np.ndarray): The padded integer image array.
+            kernel (tuple): The neighborhood size (z, y, x).
+            img_out_arr (np.ndarray): The output array, where the percentiles of each voxel are written to.
+            slab_size (int): The number of z-slices processed at once, which bounds the histogram memory.
+
+        Raises:
+            ValueError: If the image is not of an integer type or has more than max_levels gray levels.
+        """
+        if img_arr_padded.dtype.kind not in 'biu':
+            raise ValueError('the sliding histogram requires an integer or discretized image')
+
+        min_ = int(img_arr_padded.min())
+        number_of_levels = int(img_arr_padded.max()) - min_ + 1
+        if number_of_levels > self.max_levels:
+            raise ValueError('image has {} gray levels, discretize it to at most {}'.format(number_of_levels,
+                                                                                          self.max_levels))
+
+        z_offset, y_offset, x_offset = kernel
+        z, y, x = img_out_arr.shape[:3]
+        out_arr = img_out_arr.reshape((z, y, x, len(self.percentiles)))  # a view, also for scalar outputs
+
+        # the ranks of the sorted neighborhood values to interpolate between (as np.percentile)
+        number_of_values = z_offset * y_offset * x_offset
+        positions = np.asarray(self.percentiles, dtype=np.float64) / 100 * (number_of_values - 1)
+        lower = np.floor(positions).astype(np.intp)
+        upper = np.minimum(lower + 1, number_of_values - 1)
+        fraction = positions - lower
+        ranks = np.concatenate([lower, upper])
+
+        # many levels are grouped into coarse bins of bin_size levels, such that a rank is found by scanning the
+        # coarse bins and the levels of a single bin, i.e. O(sqrt(levels)) instead of O(levels) bins
+        bin_size = 1 if number_of_levels <= 256 else int(np.sqrt(number_of_levels / ranks.size))
+        number_of_bins = -(-number_of_levels // bin_size)
+
+        # the +1 of the entering and the -1 of the leaving column of a row
+        column_size = z_offset * y_offset
+        weights = np.concatenate([np.ones(column_size, np.intp), -np.ones(column_size, np.intp)])
+
+        for slab_start in range(0, z, slab_size):
+            slab_z = min(slab_size, z - slab_start)
+            number_of_rows = slab_z * y
+            levels = img_arr_padded[slab_start:slab_start + slab_z + z_offset].astype(np.intp) - min_
+
+            # the (z, y) neighborhood of each row at each x-position: (slab z, y, padded x, kernel z, kernel y)
+            columns = np.lib.stride_tricks.sliding_window_view(levels, (z_offset, y_offset), axis=(0, 1))[:slab_z, :y]
+            rows = np.arange(number_of_rows)[:, np.newaxis]
+            row_shifts = rows * (number_of_values + 1)
+            row_weights = np.tile(weights, number_of_rows)
+
+            # the histograms of the rows, updated incrementally by the values entering and leaving the neighborhoods.
+            # Without coarse bins (bin_size 1), the coarse histogram is the histogram
+            histogram = np.zeros((number_of_rows, number_of_bins * bin_size if bin_size > 1 else 0), dtype=np.intp)
+            coarse_histogram = np.zeros((number_of_rows, number_of_bins), dtype=np.intp)
+            values = np.concatenate([columns[:, :, xx].reshape((number_of_rows, -1)) for xx in range(x_offset)],
+                                    axis=1)
+            if bin_size > 1:
+                np.add.at(histogram, (rows, values), 1)
+            np.add.at(coarse_histogram, (rows, values // bin_size), 1)
+
+            for xx in range(x):
+                if xx > 0:
+                    values = np.concatenate([columns[:, :, xx + x_offset - 1].reshape((number_of_rows, -1)),
+                                             columns[:, :, xx - 1].reshape((number_of_rows, -1))], axis=1)
+                    if bin_size > 1:
+                        np.add.at(histogram.reshape(-1), (values + rows * histogram.shape[1]).ravel(), row_weights)
+                    np.add.at(coarse_histogram.reshape(-1), (values // bin_size + rows * number_of_bins).ravel(),
+                              row_weights)
+
+                # the bin of rank r is the first bin, whose cumulative count exceeds r. Shifting the cumulative
+                # histogram of each row by the row number * (number of values + 1) sorts all rows, which are then
+                # searched at once
+                cumulative = np.cumsum(coarse_histogram, axis=1)
+                bins = np.searchsorted((cumulative + row_shifts).ravel(), ranks[np.newaxis, :] + row_shifts,
+                                       side='right') - rows * number_of_bins
+                if bin_size == 1:
+                    values = bins + min_
+                else:
+                    # the level within the bin is found by the cumulative histogram of the bin's levels
+                    below = np.take_along_axis(cumulative - coarse_histogram, bins, axis=1)
+                    bin_histogram = histogram.reshape((number_of_rows, number_of_bins, bin_size))[rows, bins]
+                    within = np.count_nonzero(np.cumsum(bin_histogram, axis=2) + below[:, :, np.newaxis] <=
+                                              ranks[np.newaxis, :, np.newaxis], axis=2)
+                    values = bins * bin_size + within + min_
+                values_lower = values[:, :len(lower)]
+                values_upper = values[:, len(lower):]
+                out_arr[slab_start:slab_start + slab_z, :, xx] = \
+                    (values_lower + fraction * (values_upper - values_lower)).reshape((slab_z, y, -1))
+
+
+def _probe_process():
+    """Does nothing, executed by a spawned process to test whether processes can be spawned (see _get_pool)."""
+
+
+@functools.lru_cache(maxsize=None)
+def _get_pool(processes: int):
+    """Gets a pool of worker processes, memoized per number of processes such that the workers are spawned once.
+
+    Args:
+        processes (int): The number of worker processes.
+
+    Returns:
+        multiprocess.pool.Pool: The pool.
+
+    Raises:
+        RuntimeError: If a spawned process fails to start, e.g. as the main module of the caller is not guarded by
+            ``if __name__ == '__main__':``.
+    """
+    # spawn the workers, forking is unsafe once the threads of numba or SimpleITK are running
+    context = multiprocess.get_context('spawn')
+
+    # a spawned process imports the main module of the caller. Without a guard, the process executes the extractor
+    # again and fails, which the pool would replace by a new process forever. Probe a single process first
+    probe = context.Process(target=_probe_process)
+    probe.start()
+    probe.join()
+    if probe.exitcode != 0:
+        raise RuntimeError('the worker processes failed to start (exit code {}), guard the main module of the program '
+                           'by if __name__ == \'__main__\': or use processes=1'.format(probe.exitcode))
+
+    pool = context.Pool(processes)
+    atexit.register(pool.terminate)  # before the interpreter tears down the modules used by the pool
+    return pool
+
+
+def _execute_shared_slab(extractor, input_name: str, input_shape: tuple, input_dtype, output_name: str,
+                         output_shape: tuple, z_start: int, z_stop: int, indices: np.ndarray = None):
+    """Executes a neighborhood feature extractor on a z-slab of arrays in shared memory (run by a worker process).
+
+    Args:
+        extractor (NeighborhoodFeatureExtractor): The feature extractor.
+        input_name (str): The shared memory name of the padded image array.
+        input_shape (tuple): The shape of the padded image array.
+        input_dtype: The data type of the padded image array.
+        output_name (str): The shared memory name of the (float32) output array.
+        output_shape (tuple): The shape of the output array.
+        z_start (int): The first z-slice of the slab.
+        z_stop (int): The z-slice after the last z-slice of the slab.
+        indices (np.ndarray): The flat indices of the slab voxels to evaluate or None to evaluate all voxels.
+    """
+    input_memory = shared_memory.SharedMemory(name=input_name)
+    output_memory = shared_memory.SharedMemory(name=output_name)
+    # the memory is owned by the calling process, prevent the resource tracker of the worker from unlinking it
+    resource_tracker.unregister(input_memory._name, 'shared_memory')
+    resource_tracker.unregister(output_memory._name, 'shared_memory')
+    try:
+        img_arr_padded = np.ndarray(input_shape, dtype=input_dtype, buffer=input_memory.buf)
+        img_out_arr = np.ndarray(output_shape, dtype=np.float32, buffer=output_memory.buf)
+        # the input slab overlaps the next one by the kernel size (halo), which is read by the neighborhoods of the
+        # last slices
+        extractor._execute_arrays(img_arr_padded[z_start:z_stop + extractor.kernel[2]], img_out_arr[z_start:z_stop],
+                                  indices)
+        del img_arr_padded, img_out_arr  # release the buffers before closing
+    finally:
+        input_memory.close()
+        output_memory.close()
+
+
+class NeighborhoodFeatureExtractorParameters(fltr.FilterParams):
+    """Neighborhood feature extractor parameters."""
+
+    def __init__(self, mask: sitk.Image = None, indices: np.ndarray = None, fill_value: float = 0):
+        """Initializes a new instance of the NeighborhoodFeatureExtractorParameters
+
+        Args:
+            mask (sitk.Image): The mask image, the features are calculated at the voxels with non-zero mask values
+                only (e.g. the brain mask).
+            indices (np.ndarray): The flat indices of the voxels, at which the features are calculated, into the
+                numpy array of the image (e.g. the training voxels), alternatively to the mask.
+            fill_value (float): The feature value of the other voxels.
+        """
+        if mask is not None and indices is not None:
+            raise ValueError('either a mask or indices can be given')
+        self.mask = mask
+        self.indices = indices
+        self.fill_value = fill_value
+
+
 class NeighborhoodFeatureExtractor(fltr.Filter):
     """Represents a feature extractor filter, which works on a neighborhood."""
 
-    def __init__(self, kernel=(3, 3, 3), function_=first_order_texture_features_function):
-        """Initializes a new instance of the NeighborhoodFeatureExtractor class."""
+    def __init__(self, kernel=(3, 3, 3), function_=first_order_texture_features_function, backend: str = 'numpy',
+                 batched: bool = False, slab_size: int = 8, processes: int = 1):
+        """Initializes a new instance of the NeighborhoodFeatureExtractor class.
+
+        Args:
+            kernel (tuple): The neighborhood size (x, y, z).
+            function_: The function calculating the features of a neighborhood (3-D np.ndarray), which returns a
+                scalar or a 1-D np.ndarray. If batched, the function gets the flattened neighborhoods of many voxels
+                (np.ndarray of shape (N, k)) and returns an array of shape (N,) or (N, number of features), e.g.
+                first_order_texture_features_function_batched. A SlidingHistogramPercentiles instance calculates the
+                percentiles of integer or discretized images with a sliding histogram.
+            backend (str): The backend evaluating the function at each voxel. 'numpy' calls the function from Python,
+                'numba' compiles the function and the loop over the voxels into a parallel native kernel (the function
+                needs to be restricted to the NumPy subset supported by numba, as the built-in
+                first_order_texture_features_function, and the first use of a function is compiled, which takes tens
+                of seconds), 'auto' uses 'numba' if installed and 'numpy' otherwise. The default is 'numpy', such
+                that numba is opt-in. Batched functions and the sliding histogram always use the 'numpy' backend.
+            batched (bool): Whether the function is batched.
+            slab_size (int): The number of z-slices whose neighborhoods are passed at once to a batched function
+                (or to the sliding histogram), which bounds the memory of the flattened neighborhoods.
+            processes (int): The number of worker processes, which execute the extractor on z-slabs of the image.
+                The image and the features are shared with the workers by shared memory and the function needs to be
+                picklable (by dill). The workers are spawned once per number of processes and reused by later calls.
+                As spawned processes import the main module, the program needs to guard it by
+                ``if __name__ == '__main__':``, otherwise execute raises a RuntimeError.
+                Only the 'numpy' backend supports several processes, as the 'numba' kernel is already parallel by
+                threads and would be compiled again by each worker ('auto' uses 'numpy' for several processes).
+        """
         super().__init__()
         self.neighborhood_radius = 3
         self.kernel = kernel
         self.function = function_
-
-    def execute(self, image: sitk.Image, params: fltr.FilterParams = None) -> sitk.Image:
+        self.batched = batched
+
+        if slab_size < 1:
+            raise ValueError('slab_size needs to be at least 1')
+        self.slab_size = slab_size
+
+        if processes < 1:
+            raise ValueError('the number of processes needs to be at least 1')
+        self.processes = processes
+
+        sliding_histogram = isinstance(function_, SlidingHistogramPercentiles)
+        if backend == 'auto':
+            backend = 'numpy' if numba is None or batched or sliding_histogram or processes > 1 else 'numba'
+        if backend not in ('numpy', 'numba'):
+            raise ValueError('unknown backend "{}"'.format(backend))
+        if backend == 'numba' and numba is None:
+            raise ValueError('the numba backend requires numba to be installed')
+        if backend == 'numba' and (batched or sliding_histogram):
+            raise ValueError('batched functions and the sliding histogram require the numpy backend')
+        if backend == 'numba' and processes > 1:
+            raise ValueError('several processes require the numpy backend, the numba backend is parallel by threads')
+        self.backend = backend
+
+    def execute(self, image: sitk.Image, params: NeighborhoodFeatureExtractorParameters = None) -> sitk.Image:
         """Executes a neighborhood feature extractor on an image.
 
         Args:
             image (sitk.Image): The image.
-            params (fltr.FilterParams): The parameters (unused).
+            params (NeighborhoodFeatureExtractorParameters): The parameters restricting the voxels, at which the
+                features are calculated, or None to calculate the features at all voxels.
 
         Returns:
-            sitk.Image: The normalized image.
+            sitk.Image: The feature image.
 
         Raises:
-            ValueError: If image is not 3-D.
+            ValueError: If image is not 3-D or the mask or indices do not match the image.
         """
 
         if image.GetDimension() != 3:
             raise ValueError('image needs to be 3-D')
 
+        indices = None
+        fill_value = 0
+        if params is not None:
+            fill_value = params.fill_value
+            if params.mask is not None:
+                if params.mask.GetSize() != image.GetSize():
+                    raise ValueError('mask needs to be of the same size as the image')
+                indices = np.flatnonzero(sitk.GetArrayViewFromImage(params.mask))
+            elif params.indices is not None:
+                indices = np.unique(np.asarray(params.indices, dtype=np.intp))  # sorted, as required by the slabs
+                if indices.size > 0 and (indices[0] < 0 or indices[-1] >= image.GetNumberOfPixels()):
+                    raise ValueError('indices need to be within the image')
+
         # test the function and get the output dimension for later reshaping
-        function_output = self.function(np.array([1, 2, 3]))
-        if np.isscalar(function_output):
-            img_out = sitk.Image(image.GetSize(), sitk.sitkFloat32)
+        if self.batched:
+            function_output = self.function(np.array([[1, 2, 3]]))
+            if not isinstance(function_output, np.ndarray) or function_output.ndim not in (1, 2) or \
+                    function_output.shape[0] != 1:
+                raise ValueError('batched function must return a np.ndarray of shape (N,) or (N, number of features)')
+            function_output = function_output[0]
+        else:
+            function_output = self.function(np.array([1, 2, 3]))
+
+        if np.isscalar(function_output) or (isinstance(function_output, np.ndarray) and function_output.ndim == 0):
+            component_shape = ()
         elif not isinstance(function_output, np.ndarray):
             raise ValueError('function must return a scalar or a 1-D np.ndarray')
         elif function_output.ndim > 1:
@@ -159,9 +565,8 @@ class NeighborhoodFeatureExtractor(fltr.Filter):
         elif function_output.shape[0] <= 1:
             raise ValueError('function must return a scalar or a 1-D np.ndarray with at least two elements')
         else:
-            img_out = sitk.Image(image.GetSize(), sitk.sitkVectorFloat32, function_output.shape[0])
+            component_shape = (function_output.shape[0],)
 
-        img_out_arr = sitk.GetArrayFromImage(img_out)
         img_arr = sitk.GetArrayFromImage(image)
         z, y, x = img_arr.shape
 
@@ -171,18 +576,162 @@ class NeighborhoodFeatureExtractor(fltr.Filter):
         pad = ((0, z_offset), (0, y_offset), (0, x_offset))
         img_arr_padded = np.pad(img_arr, pad, 'symmetric')
 
-        for xx in range(x):
-            for yy in range(y):
-                for zz in range(z):
-
-                    val = self.function(img_arr_padded[zz:zz + z_offset, yy:yy + y_offset, xx:xx + x_offset])
-                    img_out_arr[zz, yy, xx] = val
+        if self.processes > 1 and z > 1:
+            img_out = self._execute_parallel(img_arr_padded, (z, y, x) + component_shape, indices, fill_value)
+        else:
+            img_out_arr = np.full((z, y, x) + component_shape, fill_value, dtype=np.float32)
+            self._execute_arrays(img_arr_padded, img_out_arr, indices)
+            img_out = sitk.GetImageFromArray(img_out_arr)
 
-        img_out = sitk.GetImageFromArray(img_out_arr)
         img_out.CopyInformation(image)
 
         return img_out
 
+    def _execute_arrays(self, img_arr_padded: np.ndarray, img_out_arr: np.ndarray, indices: np.ndarray = None):
+        """Evaluates the function at each voxel of the output array.
+
+        Args:
+            img_arr_padded (np.ndarray): The padded image array.
+            img_out_arr (np.ndarray): The output array, where the features of each voxel are written to.
+            indices (np.ndarray): The sorted flat indices of the voxels to evaluate or None to evaluate all voxels.
+        """
+        z, y, x = img_out_arr.shape[:3]
+        z_offset = self.kernel[2]
+        y_offset = self.kernel[1]
+        x_offset = self.kernel[0]
+
+        if indices is not None:
+            self._execute_indices(img_arr_padded, img_out_arr, indices)
+        elif isinstance(self.function, SlidingHistogramPercentiles):
+            self.function.execute(img_arr_padded, (z_offset, y_offset, x_offset), img_out_arr, self.slab_size)
+        elif self.batched:
+            self._execute_batched(img_arr_padded, img_out_arr)
+        elif self.backend == 'numba':
+            try:
+                kernel = _get_numba_kernel(self.function, img_out_arr.ndim == 4)
+                kernel(img_arr_padded, z_offset, y_offset, x_offset, img_out_arr)
+            except (TypeError, numba.core.errors.TypingError) as e:
+                raise ValueError('function is not supported by the numba backend') from e
+        else:
+            for xx in range(x):
+                for yy in range(y):
+                    for zz in range(z):
+
+                        val = self.function(img_arr_padded[zz:zz + z_offset, yy:yy + y_offset, xx:xx + x_offset])
+                        img_out_arr[zz, yy, xx] = val
+
+    def _execute_indices(self, img_arr_padded: np.ndarray, img_out_arr: np.ndarray, indices: np.ndarray):
+        """Evaluates the function at the given voxels of the output array.
+
+        Args:
+            img_arr_padded (np.ndarray): The padded image array.
+            img_out_arr (np.ndarray): The output array, where the features of the voxels are written to.
+            indices (np.ndarray): The sorted flat indices of the voxels to evaluate.
+        """
+        z, y, x = img_out_arr.shape[:3]
+        z_offset = self.kernel[2]
+        y_offset = self.kernel[1]
+        x_offset = self.kernel[0]
+        flat_out_arr = img_out_arr.reshape((z * y * x,) + img_out_arr.shape[3:])  # a view of the output array
+
+        if isinstance(self.function, SlidingHistogramPercentiles):
+            # the histogram slides along whole rows, calculate all voxels and keep the given ones
+            dense_out_arr = np.empty_like(img_out_arr)
+            self.function.execute(img_arr_padded, (z_offset, y_offset, x_offset), dense_out_arr, self.slab_size)
+            flat_out_arr[indices] = dense_out_arr.reshape(flat_out_arr.shape)[indices]
+        elif self.batched:
+            windows = np.lib.stride_tricks.sliding_window_view(img_arr_padded, self.kernel[::-1])
+            batch_size = self.slab_size * y * x  # the same memory bound as for all voxels
+            for batch_start in range(0, indices.size, batch_size):
+                batch_indices = indices[batch_start:batch_start + batch_size]
+                values = windows[np.unravel_index(batch_indices, (z, y, x))].reshape((batch_indices.size, -1))
+                features = self.function(values)
+                if features.shape[0] != values.shape[0]:
+                    raise ValueError('batched function returned shape {} for {} neighborhoods'.format(
+                        features.shape, values.shape[0]))
+                flat_out_arr[batch_indices] = features.reshape(flat_out_arr[batch_indices].shape)
+        elif self.backend == 'numba':
+            values_out = np.empty((indices.size,) + img_out_arr.shape[3:], dtype=img_out_arr.dtype)
+            try:
+                kernel = _get_numba_kernel(self.function, img_out_arr.ndim == 4, True)
+                kernel(img_arr_padded, z_offset, y_offset, x_offset, *np.unravel_index(indices, (z, y, x)),
+                       values_out)
+            except (TypeError, numba.core.errors.TypingError) as e:
+                raise ValueError('function is not supported by the numba backend') from e
+            flat_out_arr[indices] = values_out
+        else:
+            for zz, yy, xx in zip(*np.unravel_index(indices, (z, y, x))):
+                val = self.function(img_arr_padded[zz:zz + z_offset, yy:yy + y_offset, xx:xx + x_offset])
+                img_out_arr[zz, yy, xx] = val
+
+    def _execute_parallel(self, img_arr_padded: np.ndarray, output_shape: tuple, indices: np.ndarray = None,
+                          fill_value: float = 0) -> sitk.Image:
+        """Evaluates the function by worker processes, each on a z-slab of the image.
+
+        Args:
+            img_arr_padded (np.ndarray): The padded image array.
+            output_shape (tuple): The shape of the output array.
+            indices (np.ndarray): The sorted flat indices of the voxels to evaluate or None to evaluate all voxels.
+            fill_value (float): The value of the voxels, which are not evaluated.
+
+        Returns:
+            sitk.Image: The feature image (without image information).
+        """
+        z = output_shape[0]
+        output_size = int(np.prod(output_shape)) * np.dtype(np.float32).itemsize
+        input_memory = shared_memory.SharedMemory(create=True, size=max(1, img_arr_padded.nbytes))
+        output_memory = shared_memory.SharedMemory(create=True, size=max(1, output_size))
+        try:
+            shared_arr = np.ndarray(img_arr_padded.shape, dtype=img_arr_padded.dtype, buffer=input_memory.buf)
+            shared_arr[...] = img_arr_padded
+            # the workers write the features of their slab directly into the output array
+            img_out_arr = np.ndarray(output_shape, dtype=np.float32, buffer=output_memory.buf)
+            img_out_arr[...] = fill_value
+
+            bounds = np.linspace(0, z, min(z, self.processes) + 1).astype(int)
+            params = [(self, input_memory.name, img_arr_padded.shape, img_arr_padded.dtype, output_memory.name,
+                       output_shape, z_start, z_stop) for z_start, z_stop in zip(bounds[:-1], bounds[1:])]
+            if indices is not None:
+                # the indices of each slab, relative to the first voxel of the slab
+                slice_size = int(np.prod(output_shape[1:3]))
+                index_bounds = np.searchsorted(indices, bounds * slice_size)
+                params = [param + (indices[index_bounds[i]:index_bounds[i + 1]] - bounds[i] * slice_size,)
+                          for i, param in enumerate(params)]
+            _get_pool(len(params)).starmap(_execute_shared_slab, params)
+
+            img_out = sitk.GetImageFromArray(img_out_arr)
+            del shared_arr, img_out_arr  # release the buffers before closing
+        finally:
+            input_memory.close()
+            input_memory.unlink()
+            output_memory.close()
+            output_memory.unlink()
+
+        return img_out
+
+    def _execute_batched(self, img_arr_padded: np.ndarray, img_out_arr: np.ndarray):
+        """Evaluates a batched function slab by slab.
+
+        Args:
+            img_arr_padded (np.ndarray): The padded image array.
+            img_out_arr (np.ndarray): The output array, where the features of each voxel are written to.
+        """
+        # the neighborhoods of all voxels as zero-copy view of shape (z, y, x, kernel z, kernel y, kernel x)
+        z, y, x = img_out_arr.shape[:3]
+        windows = np.lib.stride_tricks.sliding_window_view(img_arr_padded, self.kernel[::-1])[:z, :y, :x]
+
+        for slab_start in range(0, z, self.slab_size):
+            slab_windows = windows[slab_start:slab_start + self.slab_size]
+            slab_shape = img_out_arr[slab_start:slab_start + self.slab_size].shape
+
+            # flattening the neighborhoods copies the slab only
+            values = slab_windows.reshape((-1, np.prod(self.kernel)))
+            features = self.function(values)
+            if features.shape[0] != values.shape[0] or np.prod(features.shape) != np.prod(slab_shape):
+                raise ValueError('batched function returned shape {} for {} neighborhoods'.format(
+                    features.shape, values.shape[0]))
+            img_out_arr[slab_start:slab_start + self.slab_size] = features.reshape(slab_shape)
+
     def __str__(self):
         """Gets a printable string representation.
 
@@ -190,9 +739,59 @@ class NeighborhoodFeatureExtractor(fltr.Filter):
             str: String representation.
         """
         return 'NeighborhoodFeatureExtractor:\n' \
+               ' kernel:  {self.kernel}\n' \
+               ' backend: {self.backend}\n' \
+               ' batched: {self.batched}\n' \
+               ' processes: {self.processes}\n' \
             .format(self=self)
 
 
+def _group_voxels_by_label(ground_truth: sitk.Image, ground_truth_labels: list, background_mask: sitk.Image = None):
+    """Groups the voxels of a ground truth by label in a single (radix) sort of the flat ground truth.
+
+    Args:
+        ground_truth (sitk.Image): The ground truth image.
+        ground_truth_labels (list of int): The ground truth labels.
+        background_mask (sitk.Image): A mask, where intensity 0 indicates voxels to exclude independent of the label.
+
+    Returns:
+        list of np.ndarray: The flat indices of the voxels of each label into the numpy array of the ground truth.
+    """
+    ground_truth_array = sitk.GetArrayViewFromImage(ground_truth).ravel()
+
+    # exclude background
+    if background_mask is not None:
+        candidates = np.flatnonzero(sitk.GetArrayViewFromImage(background_mask))
+        candidates = candidates[np.argsort(ground_truth_array[candidates], kind='stable')]
+    else:
+        candidates = np.argsort(ground_truth_array, kind='stable')
+    candidate_labels = ground_truth_array[candidates]
+
+    return [candidates[np.searchsorted(candidate_labels, label, side='left'):
+                       np.searchsorted(candidate_labels, label, side='right')] for label in ground_truth_labels]
+
+
+def _indices_to_mask(indices: np.ndarray, ground_truth: sitk.Image) -> sitk.Image:
+    """Converts the flat indices of training voxels to a training mask.
+
+    Args:
+        indices (np.ndarray): The flat indices of the training voxels.
+        ground_truth (sitk.Image): The ground truth image.
+
+    Returns:
+        sitk.Image: The training mask.
+    """
+    mask_array = np.zeros(ground_truth.GetNumberOfPixels(), dtype=np.uint8)
+    mask_array[indices] = 1  # these are masked items
+
+    mask = sitk.GetImageFromArray(mask_array.reshape(ground_truth.GetSize()[::-1]))
+    mask.SetOrigin(ground_truth.GetOrigin())
+    mask.SetDirection(ground_truth.GetDirection())
+    mask.SetSpacing(ground_truth.GetSpacing())
+
+    return mask
+
+
 class RandomizedTrainingMaskGenerator:
     """Represents a training mask generator.
 
@@ -200,11 +799,48 @@ class RandomizedTrainingMaskGenerator:
     Such a mask can be used to sample voxels for training.
     """
 
+    @staticmethod
+    def get_indices(ground_truth: sitk.Image,
+                    ground_truth_labels: list,
+                    label_percentages: list,
+                    background_mask: sitk.Image = None,
+                    rng: np.random.Generator = None) -> np.ndarray:
+        """Gets the training voxels.
+
+        The voxels are grouped by label in a single (radix) sort of the flat ground truth, and the voxels of each label
+        are drawn without replacement.
+
+        Args:
+            ground_truth (sitk.Image): The ground truth image.
+            ground_truth_labels (list of int): The ground truth labels,
+                where 0=background, 1=label1, 2=label2, ..., e.g. [0, 1]
+            label_percentages (list of float): The percentage of voxels of a corresponding label to extract as mask,
+                e.g. [0.2, 0.2].
+            background_mask (sitk.Image): A mask, where intensity 0 indicates voxels to exclude independent of the
+            label.
+            rng (np.random.Generator): The random number generator. If None, a generator is seeded from the global
+                NumPy random state (such that np.random.seed applies).
+
+        Returns:
+            np.ndarray: The sorted flat indices of the training voxels into the numpy array of the ground truth.
+        """
+        if rng is None:
+            rng = np.random.default_rng(np.random.randint(2 ** 32, dtype=np.uint64))
+
+        indices = []
+        for label_idx, label_indices in enumerate(_group_voxels_by_label(ground_truth, ground_truth_labels,
+                                                                         background_mask)):
+            no_mask_items = int(label_indices.size * label_percentages[label_idx])
+            indices.append(rng.choice(label_indices, no_mask_items, replace=False))
+
+        return np.sort(np.concatenate(indices))
+
     @staticmethod
     def get_mask(ground_truth: sitk.Image,
                  ground_truth_labels: list,
                  label_percentages: list,
-                 background_mask: sitk.Image = None) -> sitk.Image:
+                 background_mask: sitk.Image = None,
+                 rng: np.random.Generator = None) -> sitk.Image:
         """Gets a training mask.
 
         Args:
@@ -215,37 +851,125 @@ class RandomizedTrainingMaskGenerator:
                 e.g. [0.2, 0.2].
             background_mask (sitk.Image): A mask, where intensity 0 indicates voxels to exclude independent of the
             label.
+            rng (np.random.Generator): The random number generator (see :py:meth:`get_indices`).
 
         Returns:
             sitk.Image: The training mask.
         """
+        indices = RandomizedTrainingMaskGenerator.get_indices(ground_truth, ground_truth_labels, label_percentages,
+                                                              background_mask, rng)
+        return _indices_to_mask(indices, ground_truth)
+
+
+class BoundaryWeightedTrainingMaskGenerator:
+    """Represents a training mask generator, which prefers voxels close to label boundaries.
 
-        # initialize mask
-        ground_truth_array = sitk.GetArrayFromImage(ground_truth)
-        mask_array = np.zeros(ground_truth_array.shape, dtype=np.uint8)
+    The voxels far from any boundary are easy to classify, the generator therefore draws the voxels of each label
+    without replacement with a weight exp(-d / scale), where d is the distance (in mm) of a voxel to the nearest label
+    boundary. The distances are computed once per ground truth by a single distance transform. Instead of a percentage,
+    a sample budget is given per label.
+    """
 
-        # exclude background
-        if background_mask is not None:
-            background_mask_array = sitk.GetArrayFromImage(background_mask)
-            background_mask_array = np.logical_not(background_mask_array)
-            ground_truth_array = ground_truth_array.astype(float)  # convert to float because of np.nan
-            ground_truth_array[background_mask_array] = np.nan
+    @staticmethod
+    def get_weights(ground_truth: sitk.Image, scale: float = 3.0) -> np.ndarray:
+        """Gets the sampling weights of the voxels.
 
-        for label_idx, label in enumerate(ground_truth_labels):
-            indices = np.transpose(np.where(ground_truth_array == label))
-            np.random.shuffle(indices)
+        Args:
+            ground_truth (sitk.Image): The ground truth image.
+            scale (float): The distance (in mm) to the nearest label boundary, at which the weight decays to 1/e.
 
-            no_mask_items = int(indices.shape[0] * label_percentages[label_idx])
+        Returns:
+            np.ndarray: The flat weights in (0, 1] of the voxels, where 1 is at a boundary.
+        """
+        ground_truth_array = sitk.GetArrayViewFromImage(ground_truth)
+
+        # the boundary voxels have a 6-connected neighbor of another label
+        boundary = np.zeros(ground_truth_array.shape, dtype=np.uint8)
+        for axis in range(3):
+            different = np.diff(ground_truth_array, axis=axis) != 0
+            lower = [slice(None)] * 3
+            upper = [slice(None)] * 3
+            lower[axis] = slice(None, -1)
+            upper[axis] = slice(1, None)
+            boundary[tuple(lower)] |= different
+            boundary[tuple(upper)] |= different
+        if not boundary.any():
+            return np.ones(boundary.size)
+
+        boundary_image = sitk.GetImageFromArray(boundary)
+        boundary_image.CopyInformation(ground_truth)
+        distance = sitk.SignedMaurerDistanceMap(boundary_image, insideIsPositive=False, squaredDistance=False,
+                                                useImageSpacing=True)
+        distance_array = np.maximum(sitk.GetArrayViewFromImage(distance).ravel(), 0)
+        return np.exp(-distance_array / scale)
 
-            for no in range(no_mask_items):
-                x = indices[no][0]
-                y = indices[no][1]
-                z = indices[no][2]
-                mask_array[x, y, z] = 1  # this is a masked item
+    @staticmethod
+    def get_indices(ground_truth: sitk.Image,
+                    ground_truth_labels: list,
+                    label_budgets: list,
+                    background_mask: sitk.Image = None,
+                    rng: np.random.Generator = None,
+                    scale: float = 3.0) -> np.ndarray:
+        """Gets the training voxels.
 
-        mask = sitk.GetImageFromArray(mask_array)
-        mask.SetOrigin(ground_truth.GetOrigin())
-        mask.SetDirection(ground_truth.GetDirection())
-        mask.SetSpacing(ground_truth.GetSpacing())
+        The weighted sampling without replacement draws the voxels with the largest keys log(u) / weight, where u is
+        uniformly distributed (Efraimidis and Spirakis).
 
-        return mask
+        Args:
+            ground_truth (sitk.Image): The ground truth image.
+            ground_truth_labels (list of int): The ground truth labels,
+                where 0=background, 1=label1, 2=label2, ..., e.g. [0, 1]
+            label_budgets (list of int): The number of voxels of a corresponding label to extract as mask,
+                e.g. [1000, 2000] (all voxels of a label with fewer voxels).
+            background_mask (sitk.Image): A mask, where intensity 0 indicates voxels to exclude independent of the
+            label.
+            rng (np.random.Generator): The random number generator (see
+                :py:meth:`RandomizedTrainingMaskGenerator.get_indices`).
+            scale (float): The decay of the weights with the distance to the nearest boundary (see
+                :py:meth:`get_weights`).
+
+        Returns:
+            np.ndarray: The sorted flat indices of the training voxels into the numpy array of the ground truth.
+        """
+        if rng is None:
+            rng = np.random.default_rng(np.random.randint(2 ** 32, dtype=np.uint64))
+
+        weights = BoundaryWeightedTrainingMaskGenerator.get_weights(ground_truth, scale)
+
+        indices = []
+        for label_idx, label_indices in enumerate(_group_voxels_by_label(ground_truth, ground_truth_labels,
+                                                                         background_mask)):
+            no_mask_items = min(int(label_budgets[label_idx]), label_indices.size)
+            if no_mask_items == 0:
+                continue
+            keys = np.log(rng.random(label_indices.size)) / weights[label_indices]
+            indices.append(label_indices[np.argpartition(keys, -no_mask_items)[-no_mask_items:]])
+
+        return np.sort(np.concatenate(indices)) if indices else np.empty(0, dtype=np.intp)
+
+    @staticmethod
+    def get_mask(ground_truth: sitk.Image,
+                 ground_truth_labels: list,
+                 label_budgets: list,
+                 background_mask: sitk.Image = None,
+                 rng: np.random.Generator = None,
+                 scale: float = 3.0) -> sitk.Image:
+        """Gets a training mask.
+
+        Args:
+            ground_truth (sitk.Image): The ground truth image.
+            ground_truth_labels (list of int): The ground truth labels,
+                where 0=background, 1=label1, 2=label2, ..., e.g. [0, 1]
+            label_budgets (list of int): The number of voxels of a corresponding label to extract as mask.
+            background_mask (sitk.Image): A mask, where intensity 0 indicates voxels to exclude independent of the
+            label.
+            rng (np.random.Generator): The random number generator (see :py:meth:`get_indices`).
+            scale (float): The decay of the weights with the distance to the nearest boundary (see
+                :py:meth:`get_weights`).
+
+        Returns:
+            sitk.Image: The training mask.
+        """
+        indices = BoundaryWeightedTrainingMaskGenerator.get_indices(ground_truth, ground_truth_labels, label_budgets,
+                                                                    background_mask, rng, scale)
+        return _indices_to_mask(indices, ground_truth)
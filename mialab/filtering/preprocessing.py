@@ -28,7 +28,7 @@ class ImageNormalization(pymia_fltr.Filter):
             sitk.Image: The normalized image.
         """
 
-        img_arr = sitk.GetArrayFromImage(image)
+        img_arr = sitk.GetArrayFromImage(image).astype(np.float32)  # the features are float32
 
         # DONE: normalize the image using numpy
         min_val = np.min(img_arr)
@@ -0,0 +1,1132 @@
+"""The texture module contains voxel-based texture feature classes.
+
+The classes mirror the interface of the corresponding PyRadiomics feature classes with ``voxelBased=True``: they are
+constructed from an image and a mask, features are selected with the ``enabledFeatures`` dict and ``execute()``
+returns a dict of feature maps. Instead of calculating the texture matrix of one kernel after the other, the matrices
+of a whole batch of kernels are gathered with vectorized NumPy operations.
+"""
+import itertools
+import typing as t
+import warnings
+
+import numpy as np
+import SimpleITK as sitk
+
+
+def bin_image(image_arr: np.ndarray, mask_arr: np.ndarray, bin_width: float = 25) -> t.Tuple[np.ndarray, np.ndarray]:
+    """Discretizes the gray levels inside a mask using a fixed bin width.
+
+    The bin edges are equally spaced from zero and the lowest gray level inside the mask is assigned to bin 1,
+    which corresponds to the ``binWidth`` discretization of PyRadiomics.
+
+    Args:
+        image_arr (np.ndarray): The image array.
+        mask_arr (np.ndarray): A boolean array defining the voxels to discretize.
+        bin_width (float): The bin width.
+
+    Returns:
+        tuple: The discretized image array (0 outside the mask) and the bin edges.
+    """
+    values = image_arr[mask_arr]
+    minimum = values.min()
+    maximum = values.max()
+
+    low_bound = minimum - (minimum % bin_width)
+    edges = np.arange(low_bound, maximum + 2 * bin_width, bin_width)
+    if len(edges) == 1:  # flat region, ensure that there is one bin
+        edges = np.array([edges[0] - .5, edges[0] + .5])
+
+    discretized = np.zeros(image_arr.shape, dtype=np.int64)
+    discretized[mask_arr] = np.digitize(values, edges)
+    return discretized, edges
+
+
+def get_angles(distances: t.Iterable[int] = (1,)) -> np.ndarray:
+    """Gets the (z, y, x) offsets of the neighbours in the given (infinity norm) distances.
+
+    Only one offset of each pair of opposite directions is returned, e.g. 13 offsets for distance 1.
+
+    Args:
+        distances (iterable of int): The distances.
+
+    Returns:
+        np.ndarray: The offsets of shape (number_of_angles, 3).
+    """
+    distances = set(distances)
+    max_distance = max(distances)
+    steps = range(max_distance, -max_distance - 1, -1)
+
+    angles = []
+    for offset in itertools.product(steps, repeat=3):
+        if max(abs(o) for o in offset) not in distances:
+            continue
+        if next(o for o in offset if o != 0) > 0:  # first non-zero component is positive
+            angles.append(offset)
+    return np.array(angles, dtype=np.int64)
+
+
+def box_sum(arr: np.ndarray, radius: int) -> np.ndarray:
+    """Sums an array over the cubic neighbourhood with the given radius of each element.
+
+    The sums are calculated with one cumulative sum per axis (a separable summed-area table), i.e. with a constant
+    number of operations per element independent of the radius. Elements outside the array are treated as zero.
+
+    Args:
+        arr (np.ndarray): The array.
+        radius (int): The neighbourhood radius, e.g. 1 for a 3x3x3 neighbourhood.
+
+    Returns:
+        np.ndarray: The neighbourhood sums of the same shape as ``arr``.
+    """
+    size = 2 * radius + 1
+    for axis in range(arr.ndim):
+        pad = [(0, 0)] * arr.ndim
+        pad[axis] = (radius + 1, radius)
+        cum_sum = np.cumsum(np.pad(arr, pad), axis=axis)
+
+        length = arr.shape[axis]
+        arr = np.take(cum_sum, range(size, size + length), axis=axis) - np.take(cum_sum, range(length), axis=axis)
+    return arr
+
+
+class TextureCache:
+    """Represents the pre-pass shared by the voxel-based texture feature classes of an image and a mask.
+
+    The mask voxels, the bounding box of the mask, the kernel offsets and the discretized images are calculated once and
+    reused by all feature classes, which are constructed with the cache (``textureCache`` setting), e.g. by the GLCM,
+    first-order and GLSZM features of one modality. The arrays are cropped to the region of the kernels, i.e. the
+    bounding box of the mask padded by the kernel radius (voxels outside the image are zero and not inside the mask).
+    The gray levels and the mask of the kernel voxels are gathered once for all kernels, as arrays of shape
+    (kernel size, voxels), of which the GLCM and the GLSZM take the columns of their voxel batches.
+    """
+
+    def __init__(self, inputImage: sitk.Image, inputMask: sitk.Image, label: int = 1, kernel_radius: int = 1,
+                 masked_kernel: bool = True, voxel_mask: np.ndarray = None):
+        """Initializes a new instance of the TextureCache class.
+
+        Args:
+            inputImage (sitk.Image): The image to extract features from.
+            inputMask (sitk.Image): The mask defining the voxels to extract features at.
+            label (int): The label of the mask voxels.
+            kernel_radius (int): The kernel radius, e.g. 1 for a 3x3x3 kernel.
+            masked_kernel (bool): Whether the kernels are restricted to the mask or span the entire image.
+            voxel_mask (np.ndarray): An optional boolean array restricting the voxels to extract features at.
+        """
+        if inputImage is None or inputMask is None:
+            raise ValueError('Missing input image or mask')
+
+        self.inputImage = inputImage
+        self.inputMask = inputMask
+        self.label = label
+        self.kernel_radius = kernel_radius
+        self.masked_kernel = masked_kernel
+        self.voxel_mask = voxel_mask
+
+        mask_arr = sitk.GetArrayFromImage(inputMask) == label
+        self.voxel_coordinates = np.array(np.where(mask_arr))
+        if self.voxel_coordinates.shape[1] == 0:
+            raise ValueError('label {} not present in mask'.format(label))
+
+        if masked_kernel:
+            self.mask_arr = mask_arr
+        else:
+            self.mask_arr = np.ones(mask_arr.shape, dtype=bool)  # the kernels span the entire image
+        self.image_arr = sitk.GetArrayFromImage(inputImage)
+
+        self.bounding_box = (self.voxel_coordinates.min(1), self.voxel_coordinates.max(1) + 1)
+        self.region_origin = self.bounding_box[0] - kernel_radius
+        self.region_shape = tuple(int(s) for s in self.bounding_box[1] - self.bounding_box[0] + 2 * kernel_radius)
+        self.region_strides = np.array([self.region_shape[1] * self.region_shape[2], self.region_shape[2], 1])
+        self.region_mask_arr = self.crop(self.mask_arr)
+        self.region_image_arr = self.crop(self.image_arr)
+
+        if voxel_mask is not None:
+            if voxel_mask.shape != mask_arr.shape:
+                raise ValueError('voxel mask shape {} does not match mask shape {}'.format(voxel_mask.shape,
+                                                                                            mask_arr.shape))
+            self.voxel_coordinates = self.voxel_coordinates[:, voxel_mask[tuple(self.voxel_coordinates)].astype(bool)]
+        self.region_indices = self.get_region_flat_indices(self.voxel_coordinates)
+
+        # the (z, y, x) positions of the kernel voxels relative to the kernel center and their flat region offsets
+        steps = range(-kernel_radius, kernel_radius + 1)
+        self.kernel_positions = np.array(list(itertools.product(steps, repeat=3)), dtype=np.int64)
+        self.kernel_offsets = self.kernel_positions @ self.region_strides
+
+        self._discretizations = {}
+        self._kernel_levels = {}
+        self._kernel_mask = None
+
+    def matches(self, inputImage: sitk.Image, inputMask: sitk.Image, label: int, kernel_radius: int,
+                masked_kernel: bool, voxel_mask: np.ndarray = None) -> bool:
+        """Checks whether the cache was calculated for an image, a mask and the kernel settings.
+
+        Returns:
+            bool: True if the cache matches, otherwise False.
+        """
+        return self.inputImage is inputImage and self.inputMask is inputMask and self.label == label and \
+            self.kernel_radius == kernel_radius and self.masked_kernel == masked_kernel and \
+            voxel_mask is self.voxel_mask
+
+    def crop(self, arr: np.ndarray) -> np.ndarray:
+        """Crops an array of the image shape to the region.
+
+        Args:
+            arr (np.ndarray): The array.
+
+        Returns:
+            np.ndarray: The array of the region shape, which is zero outside the image.
+        """
+        start = self.region_origin
+        stop = start + np.array(self.region_shape)
+        clipped_start = np.maximum(start, 0)
+        clipped_stop = np.minimum(stop, arr.shape)
+
+        slices = tuple(slice(a, b) for a, b in zip(clipped_start, clipped_stop))
+        pad = [(int(a - s), int(e - b)) for s, a, b, e in zip(start, clipped_start, clipped_stop, stop)]
+        return np.pad(arr[slices], pad)
+
+    def get_region_flat_indices(self, voxel_coordinates: np.ndarray) -> np.ndarray:
+        """Gets the flat region indices of voxels.
+
+        Args:
+            voxel_coordinates (np.ndarray): The (z, y, x) image coordinates of shape (3, n).
+
+        Returns:
+            np.ndarray: The flat indices of shape (n,).
+        """
+        return np.ravel_multi_index(tuple(voxel_coordinates - self.region_origin[:, np.newaxis]), self.region_shape)
+
+    def get_discretization(self, bin_width: float = 25) -> t.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Gets the discretized image, which is calculated on first use for each bin width.
+
+        Args:
+            bin_width (float): The bin width.
+
+        Returns:
+            tuple: The discretized region (0 outside the mask), the gray levels inside the mask and the region of the
+            indices of the gray levels in these gray levels.
+        """
+        if bin_width not in self._discretizations:
+            discretized, _ = bin_image(self.image_arr, self.mask_arr, bin_width)
+            gray_levels = np.unique(discretized[self.mask_arr])
+            discretized = self.crop(discretized)
+
+            # map the gray levels to the indices of the gray levels present in the mask
+            lookup = np.zeros(int(gray_levels.max()) + 1, dtype=np.min_scalar_type(len(gray_levels)))
+            lookup[gray_levels] = np.arange(len(gray_levels))
+            self._discretizations[bin_width] = (discretized, gray_levels, lookup[discretized])
+        return self._discretizations[bin_width]
+
+    def get_kernel_levels(self, bin_width: float = 25) -> np.ndarray:
+        """Gets the gray level indices of the kernel voxels of all voxels, which are gathered on first use.
+
+        Args:
+            bin_width (float): The bin width.
+
+        Returns:
+            np.ndarray: The gray level indices (see :py:meth:`get_discretization`) of shape (kernel size, voxels).
+        """
+        if bin_width not in self._kernel_levels:
+            self._kernel_levels[bin_width] = self._gather_kernels(self.get_discretization(bin_width)[2])
+        return self._kernel_levels[bin_width]
+
+    def get_kernel_mask(self) -> np.ndarray:
+        """Gets whether the kernel voxels of all voxels are inside the mask, which is gathered on first use.
+
+        Returns:
+            np.ndarray: The mask of shape (kernel size, voxels).
+        """
+        if self._kernel_mask is None:
+            self._kernel_mask = self._gather_kernels(self.region_mask_arr)
+        return self._kernel_mask
+
+    def _gather_kernels(self, region_arr: np.ndarray) -> np.ndarray:
+        region_flat = region_arr.ravel()
+        kernels = np.empty((len(self.kernel_offsets), len(self.region_indices)), dtype=region_arr.dtype)
+        for kernel_idx, offset in enumerate(self.kernel_offsets):
+            kernels[kernel_idx] = region_flat[self.region_indices + offset]
+        return kernels
+
+
+class FeatureMap:
+    """Represents a named multi-channel feature map.
+
+    The maps of several features are the components of one vector image, e.g. all 24 GLCM features calculated in a
+    single pass. A subset of the features can be selected afterwards by name without recomputing the features.
+    """
+
+    def __init__(self, image: sitk.Image, names: t.Iterable[str]):
+        """Initializes a new instance of the FeatureMap class.
+
+        Args:
+            image (sitk.Image): The vector image with one component per feature.
+            names (iterable of str): The feature names in the order of the components.
+        """
+        self.image = image
+        self.names = list(names)
+        if image.GetNumberOfComponentsPerPixel() != len(self.names):
+            raise ValueError('{} feature names for an image with {} components'.format(
+                len(self.names), image.GetNumberOfComponentsPerPixel()))
+
+    @classmethod
+    def from_images(cls, images: t.Dict[str, sitk.Image]) -> 'FeatureMap':
+        """Composes a feature map from the feature images, e.g. returned by ``execute()`` of a feature class.
+
+        Args:
+            images (dict): The feature images, where the key is the feature name.
+
+        Returns:
+            FeatureMap: The feature map of single precision.
+        """
+        images = {name: sitk.Cast(image, sitk.sitkFloat32) for name, image in images.items()}
+        return cls(sitk.Compose(list(images.values())), images.keys())
+
+    def __getitem__(self, name: str) -> sitk.Image:
+        """Gets the map of a feature.
+
+        Args:
+            name (str): The feature name.
+
+        Returns:
+            sitk.Image: The scalar feature map.
+        """
+        return sitk.VectorIndexSelectionCast(self.image, self._get_index(name))
+
+    def select(self, names: t.Iterable[str]) -> 'FeatureMap':
+        """Selects a subset of the features.
+
+        Args:
+            names (iterable of str): The feature names in the order of the components of the selected map.
+
+        Returns:
+            FeatureMap: The feature map of the selected features.
+        """
+        names = list(names)
+        indices = [self._get_index(name) for name in names]
+
+        arr = sitk.GetArrayViewFromImage(self.image)
+        if self.image.GetNumberOfComponentsPerPixel() == 1:
+            arr = arr[..., np.newaxis]  # the array of a single component image has no component axis
+        image = sitk.GetImageFromArray(arr[..., indices], isVector=True)
+        image.CopyInformation(self.image)
+        return FeatureMap(image, names)
+
+    def _get_index(self, name: str) -> int:
+        if name not in self.names:
+            raise ValueError('feature {} not in feature map'.format(name))
+        return self.names.index(name)
+
+
+class VoxelBasedFeaturesBase:
+    """Represents the base class of the voxel-based texture feature classes.
+
+    The supported settings are named as in PyRadiomics (``label``, ``kernelRadius``, ``maskedKernel``, ``binWidth``,
+    ``initValue`` and ``voxelBatch``), such that the parameters of an existing PyRadiomics setup can be reused.
+    Additionally, the ``voxelMask`` setting (a boolean array of the image shape) restricts the voxels, at which features
+    are calculated, e.g. to the sampled training voxels. The kernels and the discretization still span the whole mask,
+    i.e. the features at these voxels equal the ones calculated without ``voxelMask``. The ``textureCache`` setting
+    passes a :py:class:`TextureCache` shared with other feature classes of the same image, mask and voxel mask.
+    """
+
+    def __init__(self, inputImage: sitk.Image, inputMask: sitk.Image, **kwargs):
+        """Initializes a new instance of the VoxelBasedFeaturesBase class.
+
+        Args:
+            inputImage (sitk.Image): The image to extract features from.
+            inputMask (sitk.Image): The mask defining the voxels to extract features at.
+        """
+        if inputImage is None or inputMask is None:
+            raise ValueError('Missing input image or mask')
+
+        self.settings = kwargs
+        self.label = kwargs.get('label', 1)
+        self.kernel_radius = kwargs.get('kernelRadius', 1)
+
+        self.enabledFeatures = {}
+        self.featureValues = {}
+
+        self.inputImage = inputImage
+        self.inputMask = inputMask
+
+        masked_kernel = kwargs.get('maskedKernel', True)
+        voxel_mask = kwargs.get('voxelMask', None)
+        self.cache = kwargs.get('textureCache', None)
+        if self.cache is None:
+            self.cache = TextureCache(inputImage, inputMask, self.label, self.kernel_radius, masked_kernel, voxel_mask)
+        elif not self.cache.matches(inputImage, inputMask, self.label, self.kernel_radius, masked_kernel, voxel_mask):
+            raise ValueError('texture cache does not match the image, mask or settings')
+
+        self.mask_arr = self.cache.mask_arr
+        self.image_arr = self.cache.image_arr
+        self.voxel_coordinates = self.cache.voxel_coordinates
+
+    @classmethod
+    def getFeatureNames(cls) -> t.List[str]:
+        """Gets the names of the features of this class.
+
+        Features are identified by a ``get<Feature>FeatureValue`` method.
+
+        Returns:
+            list of str: The feature names.
+        """
+        return [name[3:-12] for name in dir(cls) if name.startswith('get') and name.endswith('FeatureValue')]
+
+    def enableAllFeatures(self):
+        """Enables all features of this class."""
+        self.enabledFeatures = {name: True for name in self.getFeatureNames()}
+
+    def execute(self) -> t.Dict[str, sitk.Image]:
+        """Calculates the feature maps of all enabled features.
+
+        Returns:
+            dict: The feature maps, where the key is the feature name and the value is an image, which holds the
+            feature values at the mask voxels (restricted to ``voxelMask``, if set) and ``initValue`` elsewhere.
+        """
+        feature_arr, features = self._calculate_features()
+
+        self.featureValues = {}
+        for feature_idx, name in enumerate(features):
+            self.featureValues[name] = sitk.GetImageFromArray(feature_arr[..., feature_idx])
+            self.featureValues[name].CopyInformation(self.inputImage)
+        return self.featureValues
+
+    def executeFeatureMap(self) -> FeatureMap:
+        """Calculates the feature maps of all enabled features as a named multi-channel map.
+
+        The texture matrices of each kernel are calculated once and all enabled features are evaluated from them.
+
+        Returns:
+            FeatureMap: The feature map with one component per enabled feature, in the order of ``enabledFeatures``.
+        """
+        feature_arr, features = self._calculate_features()
+
+        image = sitk.GetImageFromArray(feature_arr, isVector=True)
+        image.CopyInformation(self.inputImage)
+        return FeatureMap(image, features)
+
+    def _calculate_features(self) -> t.Tuple[np.ndarray, t.List[str]]:
+        """Calculates the enabled features.
+
+        Returns:
+            tuple: The feature array of the image shape with an additional last axis for the features and the names of
+            the features.
+        """
+        if len(self.enabledFeatures) == 0:
+            self.enableAllFeatures()
+
+        features = [name for name, enabled in self.enabledFeatures.items() if enabled]
+        unknown_features = set(features) - set(self.getFeatureNames())
+        if unknown_features:
+            raise ValueError('unknown features: {}'.format(', '.join(sorted(unknown_features))))
+
+        init_value = self.settings.get('initValue', 0)
+        # the features are calculated in double precision per batch but stored in single precision
+        feature_arr = np.full(self.mask_arr.shape + (len(features),), init_value, dtype=np.float32)
+
+        voxel_count = self.voxel_coordinates.shape[1]
+        voxel_batch = self.settings.get('voxelBatch', -1)
+        if voxel_batch <= 0:
+            voxel_batch = self._get_default_voxel_batch()
+
+        # kernels without any voxel pair along an angle are NaN and ignored when averaging over the angles
+        with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for batch_idx in range(0, voxel_count, voxel_batch):
+                voxel_slice = slice(batch_idx, batch_idx + voxel_batch)
+                self._init_calculation(voxel_slice)
+                voxel_coordinates = tuple(self.voxel_coordinates[:, voxel_slice])
+                for feature_idx, name in enumerate(features):
+                    feature_values = getattr(self, 'get{}FeatureValue'.format(name))()
+                    feature_arr[voxel_coordinates + (feature_idx,)] = feature_values
+        return feature_arr, features
+
+    def _get_default_voxel_batch(self) -> int:
+        """Gets the number of kernels calculated at once if no ``voxelBatch`` is set.
+
+        Returns:
+            int: The number of kernels.
+        """
+        return max(1, self.voxel_coordinates.shape[1])
+
+    def _init_calculation(self, voxel_slice: slice):
+        """Prepares the calculation of the features of a batch of kernels.
+
+        Args:
+            voxel_slice (slice): The slice of ``voxel_coordinates`` defining the kernel centers of the batch.
+        """
+        raise NotImplementedError()
+
+
+class VoxelBasedGLCM(VoxelBasedFeaturesBase):
+    """Represents a voxel-based gray level co-occurrence matrix (GLCM) feature class.
+
+    The feature maps equal the ones of ``radiomics.glcm.RadiomicsGLCM`` with ``voxelBased=True``. The GLCM of a kernel
+    counts the neighbouring voxel pairs, of which both voxels lie inside the kernel (and the mask). For each angle, the
+    possible positions of such a pair in the kernel are known beforehand, which allows to take the pairs of many kernels
+    from the gathered kernels of the :py:class:`TextureCache` and to count them with a single ``np.bincount``.
+
+    Unlike PyRadiomics, the MCC of kernels with empty angles is averaged over the remaining angles, instead of failing
+    the feature for the whole voxel batch.
+    """
+
+    def __init__(self, inputImage: sitk.Image, inputMask: sitk.Image, **kwargs):
+        """Initializes a new instance of the VoxelBasedGLCM class.
+
+        Args:
+            inputImage (sitk.Image): The image to extract features from.
+            inputMask (sitk.Image): The mask defining the voxels to extract features at.
+        """
+        super().__init__(inputImage, inputMask, **kwargs)
+        self.symmetrical = kwargs.get('symmetricalGLCM', True)
+
+        self.bin_width = kwargs.get('binWidth', 25)
+        _, self.gray_levels, _ = self.cache.get_discretization(self.bin_width)
+        self.ng_max = int(self.gray_levels.max())
+        self._pairs = self._get_pairs(get_angles(kwargs.get('distances', [1])))
+
+        # gray level vectors and the one-hot matrices mapping (i, j) to i + j and |i - j|
+        self._eps = np.spacing(1)
+        self._levels = self.gray_levels.astype(float)
+        self._k_values_sum = np.arange(2, (self.ng_max * 2) + 1, dtype=float)
+        self._k_values_diff = np.arange(0, self.ng_max, dtype=float)
+        i, j = np.meshgrid(self._levels, self._levels, indexing='ij')
+        self._sum_one_hot = ((i + j).reshape((-1, 1)) == self._k_values_sum).astype(float)
+        self._diff_one_hot = (np.abs(i - j).reshape((-1, 1)) == self._k_values_diff).astype(float)
+
+        self.p_glcm = None
+        self.coefficients = {}
+
+    def _get_default_voxel_batch(self) -> int:
+        ng = len(self.gray_levels)
+        return max(1, 2 ** 22 // (ng * ng * max(len(self._pairs), 1)))
+
+    def _get_pairs(self, angles: np.ndarray) -> t.List[t.Tuple[np.ndarray, np.ndarray]]:
+        """Gets the kernel positions of the voxel pairs inside a kernel for each angle.
+
+        Angles without any voxel pair in all kernels are removed, as PyRadiomics does.
+
+        Args:
+            angles (np.ndarray): The angles of shape (number_of_angles, 3).
+
+        Returns:
+            list of tuple: The indices of the kernel positions (see ``TextureCache.kernel_positions``) of the first and
+            the second voxel of the pairs for each (non-empty) angle.
+        """
+        position_indices = {tuple(position): idx for idx, position in enumerate(self.cache.kernel_positions)}
+        kernel_mask = self.cache.get_kernel_mask()
+
+        pairs = []
+        for angle in angles:
+            # the first voxel needs to be placed such that both voxels of the pair are inside the kernel
+            first = [idx for idx, position in enumerate(self.cache.kernel_positions)
+                     if tuple(position + angle) in position_indices]
+            if len(first) == 0:
+                continue
+            second = [position_indices[tuple(self.cache.kernel_positions[idx] + angle)] for idx in first]
+
+            # check if any kernel holds a voxel pair along this angle
+            if any(np.any(kernel_mask[i] & kernel_mask[j]) for i, j in zip(first, second)):
+                pairs.append((np.array(first), np.array(second)))
+        return pairs
+
+    def _init_calculation(self, voxel_slice: slice):
+        ng = len(self.gray_levels)
+        levels = self.cache.get_kernel_levels(self.bin_width)[:, voxel_slice]
+        kernel_mask = self.cache.get_kernel_mask()[:, voxel_slice]
+        no_voxels = levels.shape[1]
+        voxel_offsets = np.arange(no_voxels, dtype=np.int64) * ng
+
+        # the GLCMs are of shape (voxels, angles, ng, ng)
+        p_glcm = np.zeros((no_voxels, max(len(self._pairs), 1), ng, ng))
+        for a_idx, (first, second) in enumerate(self._pairs):
+            valid = kernel_mask[first] & kernel_mask[second]
+            flat_glcm_idx = (voxel_offsets + levels[first]) * ng + levels[second]
+            p_glcm[:, a_idx] = np.bincount(flat_glcm_idx[valid],
+                                           minlength=no_voxels * ng * ng).reshape((no_voxels, ng, ng))
+
+        if self.symmetrical:
+            p_glcm += np.swapaxes(p_glcm, 2, 3)
+
+        sum_p_glcm = np.sum(p_glcm, (2, 3))
+        sum_p_glcm[sum_p_glcm == 0] = np.nan  # empty angles result in NaN and are ignored when averaging
+        p_glcm /= sum_p_glcm[:, :, np.newaxis, np.newaxis]
+
+        self.p_glcm = p_glcm
+        self.coefficients = {}
+
+    def _get_coefficient(self, name: str) -> np.ndarray:
+        """Gets a coefficient shared by several GLCM features of the current batch.
+
+        The coefficients are calculated on first use, such that only the ones of the enabled features are calculated.
+
+        Args:
+            name (str): The coefficient name.
+
+        Returns:
+            np.ndarray: The coefficient.
+        """
+        if name not in self.coefficients:
+            self.coefficients[name] = getattr(self, '_calculate_{}'.format(name))()
+        return self.coefficients[name]
+
+    def _calculate_px(self):
+        return np.sum(self.p_glcm, 3)  # shape (voxels, angles, ng)
+
+    def _calculate_py(self):
+        return np.sum(self.p_glcm, 2)
+
+    def _calculate_ux(self):
+        return self._get_coefficient('px') @ self._levels  # shape (voxels, angles)
+
+    def _calculate_uy(self):
+        return self._get_coefficient('py') @ self._levels
+
+    def _calculate_px_add_y(self):
+        flat_p_glcm = self.p_glcm.reshape(self.p_glcm.shape[:2] + (-1,))
+        return flat_p_glcm @ self._sum_one_hot  # shape (voxels, angles, 2 * ng_max - 1)
+
+    def _calculate_px_sub_y(self):
+        flat_p_glcm = self.p_glcm.reshape(self.p_glcm.shape[:2] + (-1,))
+        return flat_p_glcm @ self._diff_one_hot  # shape (voxels, angles, ng_max)
+
+    def _calculate_hxy(self):
+        return (-1) * np.sum(self.p_glcm * np.log2(self.p_glcm + self._eps), (2, 3))
+
+    def _calculate_px_py(self):
+        return self._get_coefficient('px')[..., :, np.newaxis] * self._get_coefficient('py')[..., np.newaxis, :]
+
+    def getAutocorrelationFeatureValue(self):
+        ac = np.sum(self.p_glcm @ self._levels * self._levels, 2)
+        return np.nanmean(ac, 1)
+
+    def getJointAverageFeatureValue(self):
+        return self._get_coefficient('ux').mean(1)
+
+    def _get_cluster_moment(self, power: int):
+        # sum over i and j of p(i, j) (i + j - ux - uy)^power, grouped by k = i + j
+        mu = self._get_coefficient('ux') + self._get_coefficient('uy')
+        moment = np.sum(self._get_coefficient('px_add_y') * (self._k_values_sum - mu[..., np.newaxis]) ** power, 2)
+        return np.nanmean(moment, 1)
+
+    def getClusterProminenceFeatureValue(self):
+        return self._get_cluster_moment(4)
+
+    def getClusterShadeFeatureValue(self):
+        return self._get_cluster_moment(3)
+
+    def getClusterTendencyFeatureValue(self):
+        return self._get_cluster_moment(2)
+
+    def getContrastFeatureValue(self):
+        contrast = self._get_coefficient('px_sub_y') @ (self._k_values_diff ** 2)
+        return np.nanmean(contrast, 1)
+
+    def getCorrelationFeatureValue(self):
+        ux, uy = self._get_coefficient('ux'), self._get_coefficient('uy')
+        i_centered = self._levels - ux[..., np.newaxis]
+        j_centered = self._levels - uy[..., np.newaxis]
+        sigx = np.sum(self._get_coefficient('px') * i_centered ** 2, 2) ** 0.5
+        sigy = np.sum(self._get_coefficient('py') * j_centered ** 2, 2) ** 0.5
+        corm = np.sum(np.sum(self.p_glcm * j_centered[..., np.newaxis, :], 3) * i_centered, 2)
+
+        corr = corm / (sigx * sigy + self._eps)
+        corr[sigx * sigy == 0] = 1  # flat region
+        return np.nanmean(corr, 1)
+
+    def getDifferenceAverageFeatureValue(self):
+        diff_avg = self._get_coefficient('px_sub_y') @ self._k_values_diff
+        return np.nanmean(diff_avg, 1)
+
+    def getDifferenceEntropyFeatureValue(self):
+        px_sub_y = self._get_coefficient('px_sub_y')
+        diff_entropy = (-1) * np.sum(px_sub_y * np.log2(px_sub_y + self._eps), 2)
+        return np.nanmean(diff_entropy, 1)
+
+    def getDifferenceVarianceFeatureValue(self):
+        px_sub_y = self._get_coefficient('px_sub_y')
+        diff_avg = px_sub_y @ self._k_values_diff
+        diff_var = np.sum(px_sub_y * (self._k_values_diff - diff_avg[..., np.newaxis]) ** 2, 2)
+        return np.nanmean(diff_var, 1)
+
+    def getJointEnergyFeatureValue(self):
+        energy = np.sum(self.p_glcm ** 2, (2, 3))
+        return np.nanmean(energy, 1)
+
+    def getJointEntropyFeatureValue(self):
+        return np.nanmean(self._get_coefficient('hxy'), 1)
+
+    def getImc1FeatureValue(self):
+        px, py = self._get_coefficient('px'), self._get_coefficient('py')
+        hx = (-1) * np.sum(px * np.log2(px + self._eps), 2)
+        hy = (-1) * np.sum(py * np.log2(py + self._eps), 2)
+        hxy1 = (-1) * np.sum(self.p_glcm * np.log2(self._get_coefficient('px_py') + self._eps), (2, 3))
+
+        div = np.fmax(hx, hy)
+        imc1 = self._get_coefficient('hxy') - hxy1
+        imc1[div != 0] /= div[div != 0]
+        imc1[div == 0] = 0  # flat region
+        return np.nanmean(imc1, 1)
+
+    def getImc2FeatureValue(self):
+        px_py = self._get_coefficient('px_py')
+        hxy = self._get_coefficient('hxy')
+        hxy2 = (-1) * np.sum(px_py * np.log2(px_py + self._eps), (2, 3))
+
+        imc2 = (1 - np.e ** (-2 * (hxy2 - hxy))) ** 0.5
+        imc2[hxy2 == hxy] = 0
+        return np.nanmean(imc2, 1)
+
+    def getIdmFeatureValue(self):
+        idm = self._get_coefficient('px_sub_y') @ (1 / (1 + self._k_values_diff ** 2))
+        return np.nanmean(idm, 1)
+
+    def getMCCFeatureValue(self):
+        ng = self.p_glcm.shape[2]
+        if ng < 2:
+            return 1  # flat region
+
+        # Q(i, j) = sum over k of p(i, k) p(j, k) / (px(i) py(k)), as a batched matrix product
+        px, py = self._get_coefficient('px'), self._get_coefficient('py')
+        q = (self.p_glcm / (px[..., :, np.newaxis] * py[..., np.newaxis, :] + self._eps)) @ \
+            np.swapaxes(self.p_glcm, 2, 3)
+
+        finite = np.all(np.isfinite(q), (2, 3))
+        mcc = np.full(finite.shape, np.nan)
+        if np.any(finite):
+            eigenvalues = np.sort(np.linalg.eigvals(q[finite]), axis=-1)
+            mcc[finite] = np.sqrt(eigenvalues[:, -2]).real  # second largest eigenvalue
+        return np.nanmean(mcc, 1)
+
+    def getIdmnFeatureValue(self):
+        idmn = self._get_coefficient('px_sub_y') @ (1 / (1 + (self._k_values_diff ** 2) / (self.ng_max ** 2)))
+        return np.nanmean(idmn, 1)
+
+    def getIdFeatureValue(self):
+        inv_diff = self._get_coefficient('px_sub_y') @ (1 / (1 + self._k_values_diff))
+        return np.nanmean(inv_diff, 1)
+
+    def getIdnFeatureValue(self):
+        idn = self._get_coefficient('px_sub_y') @ (1 / (1 + self._k_values_diff / self.ng_max))
+        return np.nanmean(idn, 1)
+
+    def getInverseVarianceFeatureValue(self):
+        inv_var = self._get_coefficient('px_sub_y')[..., 1:] @ (1 / self._k_values_diff[1:] ** 2)  # skip k = 0
+        return np.nanmean(inv_var, 1)
+
+    def getMaximumProbabilityFeatureValue(self):
+        max_prob = np.amax(self.p_glcm, (2, 3))
+        return np.nanmean(max_prob, 1)
+
+    def getSumAverageFeatureValue(self):
+        sum_avg = self._get_coefficient('px_add_y') @ self._k_values_sum
+        return np.nanmean(sum_avg, 1)
+
+    def getSumEntropyFeatureValue(self):
+        px_add_y = self._get_coefficient('px_add_y')
+        sum_entropy = (-1) * np.sum(px_add_y * np.log2(px_add_y + self._eps), 2)
+        return np.nanmean(sum_entropy, 1)
+
+    def getSumSquaresFeatureValue(self):
+        i_centered = self._levels - self._get_coefficient('ux')[..., np.newaxis]
+        ss = np.sum(self._get_coefficient('px') * i_centered ** 2, 2)
+        return np.nanmean(ss, 1)
+
+
+class VoxelBasedFirstOrder(VoxelBasedFeaturesBase):
+    """Represents a voxel-based first-order feature class.
+
+    The feature maps equal the ones of ``radiomics.firstorder.RadiomicsFirstOrder`` with ``voxelBased=True``.
+    The moment-based features (mean, variance, skewness, kurtosis, energy and root mean squared) are derived from
+    neighbourhood sums of the powers x, x^2, x^3 and x^4, which are calculated once for the whole image with summed-area
+    tables (see :py:func:`box_sum`). The same holds for the gray level histograms used by the entropy and the
+    uniformity. Only the rank-based features (minimum, maximum, percentiles and the mean absolute deviations) need the
+    kernel values themselves, which are gathered and sorted once per voxel batch.
+    """
+
+    def __init__(self, inputImage: sitk.Image, inputMask: sitk.Image, **kwargs):
+        """Initializes a new instance of the VoxelBasedFirstOrder class.
+
+        Args:
+            inputImage (sitk.Image): The image to extract features from.
+            inputMask (sitk.Image): The mask defining the voxels to extract features at.
+        """
+        super().__init__(inputImage, inputMask, **kwargs)
+        self.voxel_array_shift = kwargs.get('voxelArrayShift', 0)
+        self.voxel_volume = float(np.prod(inputImage.GetSpacing()))
+
+        self.discretized_arr, self.gray_levels, _ = self.cache.get_discretization(kwargs.get('binWidth', 25))
+        self._kernel_offsets = self.cache.kernel_offsets
+
+        self._voxel_stats = {}  # neighbourhood statistics at all voxels, calculated on first use
+        self._image_flat = None
+        self._values = None
+        self._voxel_slice = None
+
+    def _get_default_voxel_batch(self) -> int:
+        return max(1, 2 ** 22 // len(self._kernel_offsets))
+
+    def _init_calculation(self, voxel_slice: slice):
+        self._voxel_slice = voxel_slice
+        self._values = None  # the kernel values are only gathered if a rank-based feature is enabled
+
+    def _get_voxel_stat(self, name: str) -> np.ndarray:
+        """Gets a neighbourhood statistic at the voxels of the current batch.
+
+        Args:
+            name (str): The statistic name, i.e. 'count', 'histogram', 'mean', 'mean_square', 'moments' or
+                'ill_conditioned'.
+
+        Returns:
+            np.ndarray: The statistic.
+        """
+        return self._get_all_voxel_stat(name)[..., self._voxel_slice]
+
+    def _get_all_voxel_stat(self, name: str) -> np.ndarray:
+        """Gets a neighbourhood statistic at all voxels, which is calculated on first use.
+
+        Args:
+            name (str): The statistic name.
+
+        Returns:
+            np.ndarray: The statistic.
+        """
+        if name not in self._voxel_stats:
+            if name in ('count', 'histogram'):
+                getattr(self, '_calculate_{}'.format(name))()
+            else:
+                self._calculate_moments()
+        return self._voxel_stats[name]
+
+    def _gather_voxel_stat(self, arr: np.ndarray) -> np.ndarray:
+        """Calculates the neighbourhood sums of an array and gathers them at all voxels.
+
+        Args:
+            arr (np.ndarray): The array.
+
+        Returns:
+            np.ndarray: The neighbourhood sums at the voxels.
+        """
+        return box_sum(arr, self.kernel_radius).ravel()[self.cache.region_indices]
+
+    def _calculate_count(self):
+        self._voxel_stats['count'] = self._gather_voxel_stat(self.cache.region_mask_arr.astype(float))
+
+    def _calculate_moments(self):
+        count = self._get_all_voxel_stat('count')
+
+        # the powers are calculated relative to the mean inside the mask to reduce the cancellation
+        mask_arr, image_arr = self.cache.region_mask_arr, self.cache.region_image_arr
+        shift = np.mean(image_arr[mask_arr], dtype=float)
+        centered = np.where(mask_arr, image_arr - shift, 0).astype(float)
+        power_sums = [self._gather_voxel_stat(centered ** power) / count for power in range(1, 5)]
+
+        s1, s2, s3, s4 = power_sums
+        m2 = s2 - s1 ** 2
+        m3 = s3 - 3 * s1 * s2 + 2 * s1 ** 3
+        m4 = s4 - 4 * s1 * s3 + 6 * s1 ** 2 * s2 - 3 * s1 ** 4
+
+        self._voxel_stats['mean'] = s1 + shift
+        self._voxel_stats['mean_square'] = s2 + 2 * shift * s1 + shift ** 2  # mean of x^2
+        self._voxel_stats['moments'] = np.stack([m2, m3, m4])
+
+        # the central moments of (nearly) flat kernels suffer from cancellation and are calculated from the values
+        self._voxel_stats['ill_conditioned'] = m2 <= 1e-3 * s2
+
+    def _calculate_histogram(self):
+        count = self._get_all_voxel_stat('count')
+        eps = np.spacing(1)
+
+        entropy = np.zeros(count.shape)
+        uniformity = np.zeros(count.shape)
+        for gray_level in self.gray_levels:
+            p = self._gather_voxel_stat((self.discretized_arr == gray_level).astype(float)) / count
+            entropy -= p * np.log2(p + eps)
+            uniformity += p ** 2
+
+        self._voxel_stats['histogram'] = np.stack([entropy, uniformity])
+
+    def _get_values(self) -> np.ndarray:
+        """Gets the sorted kernel values of the current batch.
+
+        Returns:
+            np.ndarray: The kernel values of shape (voxels, kernel size), with the voxels outside the mask set to NaN
+            and sorted to the end.
+        """
+        if self._values is None:
+            if self._image_flat is None:
+                image = np.where(self.cache.region_mask_arr, self.cache.region_image_arr, np.nan).astype(float)
+                self._image_flat = image.ravel()
+
+            centers = self.cache.region_indices[self._voxel_slice]
+            self._values = np.sort(self._image_flat[centers[:, np.newaxis] + self._kernel_offsets], axis=1)
+        return self._values
+
+    def _get_percentile(self, q: float) -> np.ndarray:
+        """Gets a percentile of the kernel values of the current batch (linear interpolation as ``np.percentile``).
+
+        Args:
+            q (float): The percentile in [0, 100].
+
+        Returns:
+            np.ndarray: The percentiles.
+        """
+        values = self._get_values()
+        position = q / 100 * (self._get_voxel_stat('count') - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, values.shape[1] - 1)
+        fraction = position - lower
+
+        rows = np.arange(values.shape[0])
+        lower_values = values[rows, lower]
+        upper_values = np.where(fraction > 0, values[rows, upper], lower_values)
+        return lower_values + (upper_values - lower_values) * fraction
+
+    def _get_moments(self) -> np.ndarray:
+        """Gets the second, third and fourth central moment of the kernel values of the current batch.
+
+        Returns:
+            np.ndarray: The moments of shape (3, voxels).
+        """
+        moments = self._get_voxel_stat('moments').copy()
+        ill_conditioned = self._get_voxel_stat('ill_conditioned')
+        if np.any(ill_conditioned):
+            values = self._get_values()[ill_conditioned]
+            deviation = values - np.nanmean(values, 1, keepdims=True)
+            moments[:, ill_conditioned] = [np.nanmean(deviation ** power, 1) for power in range(2, 5)]
+        return moments
+
+    def getEnergyFeatureValue(self):
+        shift = self.voxel_array_shift
+        count = self._get_voxel_stat('count')
+        return count * (self._get_voxel_stat('mean_square') + 2 * shift * self._get_voxel_stat('mean') + shift ** 2)
+
+    def getTotalEnergyFeatureValue(self):
+        return self.getEnergyFeatureValue() * self.voxel_volume
+
+    def getEntropyFeatureValue(self):
+        return self._get_voxel_stat('histogram')[0]
+
+    def getMinimumFeatureValue(self):
+        return self._get_values()[:, 0]
+
+    def get10PercentileFeatureValue(self):
+        return self._get_percentile(10)
+
+    def get90PercentileFeatureValue(self):
+        return self._get_percentile(90)
+
+    def getMaximumFeatureValue(self):
+        values = self._get_values()
+        return values[np.arange(values.shape[0]), self._get_voxel_stat('count').astype(np.int64) - 1]
+
+    def getMeanFeatureValue(self):
+        return self._get_voxel_stat('mean')
+
+    def getMedianFeatureValue(self):
+        return self._get_percentile(50)
+
+    def getInterquartileRangeFeatureValue(self):
+        return self._get_percentile(75) - self._get_percentile(25)
+
+    def getRangeFeatureValue(self):
+        return self.getMaximumFeatureValue() - self.getMinimumFeatureValue()
+
+    def getMeanAbsoluteDeviationFeatureValue(self):
+        values = self._get_values()
+        return np.nanmean(np.absolute(values - self._get_voxel_stat('mean')[:, np.newaxis]), 1)
+
+    def getRobustMeanAbsoluteDeviationFeatureValue(self):
+        values = self._get_values()
+        percentile_10 = self._get_percentile(10)[:, np.newaxis]
+        percentile_90 = self._get_percentile(90)[:, np.newaxis]
+        values = np.where((values < percentile_10) | (values > percentile_90), np.nan, values)
+        return np.nanmean(np.absolute(values - np.nanmean(values, 1, keepdims=True)), 1)
+
+    def getRootMeanSquaredFeatureValue(self):
+        shift = self.voxel_array_shift
+        return np.sqrt(self._get_voxel_stat('mean_square') + 2 * shift * self._get_voxel_stat('mean') + shift ** 2)
+
+    def getSkewnessFeatureValue(self):
+        m2, m3, _ = self._get_moments()
+        m2[m2 == 0] = 1  # flat region
+        return m3 / m2 ** 1.5
+
+    def getKurtosisFeatureValue(self):
+        m2, _, m4 = self._get_moments()
+        m2[m2 == 0] = 1  # flat region
+        return m4 / m2 ** 2.0
+
+    def getVarianceFeatureValue(self):
+        return self._get_moments()[0]
+
+    def getUniformityFeatureValue(self):
+        return self._get_voxel_stat('histogram')[1]
+
+
+class VoxelBasedGLSZM(VoxelBasedFeaturesBase):
+    """Represents a voxel-based gray level size zone matrix (GLSZM) feature class.
+
+    The feature maps equal the ones of ``radiomics.glszm.RadiomicsGLSZM`` with ``voxelBased=True``. The zones need to be
+    labelled inside each kernel, as a zone of the whole image might split into several zones at the kernel border.
+    Instead of growing the zones kernel after kernel, the zones of a whole batch of kernels are labelled at once by a
+    union-find like label propagation over the fixed neighbourhood graph of the kernel positions (26-connectivity):
+    the edges between neighbouring positions with equal gray levels are swept, merging the labels of both positions to
+    the smaller one, until the labels do not change anymore. Kernels without any such edge are skipped.
+    """
+
+    def __init__(self, inputImage: sitk.Image, inputMask: sitk.Image, **kwargs):
+        """Initializes a new instance of the VoxelBasedGLSZM class.
+
+        Args:
+            inputImage (sitk.Image): The image to extract features from.
+            inputMask (sitk.Image): The mask defining the voxels to extract features at.
+        """
+        super().__init__(inputImage, inputMask, **kwargs)
+
+        self.bin_width = kwargs.get('binWidth', 25)
+        _, self.gray_levels, _ = self.cache.get_discretization(self.bin_width)
+
+        # the edges between neighbouring kernel positions (26-connectivity)
+        positions = self.cache.kernel_positions
+        adjacency = np.abs(positions[:, np.newaxis, :] - positions[np.newaxis, :, :]).max(2) == 1
+        self._edges = np.transpose(np.nonzero(np.triu(adjacency)))
+
+        self.p_glszm = None
+        self.coefficients = {}
+
+    def _get_default_voxel_batch(self) -> int:
+        return max(1, 2 ** 22 // max(len(self.cache.kernel_offsets) * len(self.gray_levels), len(self._edges)))
+
+    def _label_zones(self, levels: np.ndarray, valid: np.ndarray) -> np.ndarray:
+        """Labels the zones of a batch of kernels.
+
+        Args:
+            levels (np.ndarray): The gray level indices of the kernel positions of shape (kernel size, voxels).
+            valid (np.ndarray): Whether the kernel positions are inside the image and the mask.
+
+        Returns:
+            np.ndarray: The labels of shape (kernel size, voxels), where each zone is labelled by its smallest position.
+        """
+        kernel_size, no_voxels = levels.shape
+        labels = np.tile(np.arange(kernel_size, dtype=np.min_scalar_type(kernel_size))[:, np.newaxis], (1, no_voxels))
+
+        # two neighbouring positions are linked if both are inside the mask and have the same gray level
+        first, second = self._edges[:, 0], self._edges[:, 1]
+        linked = valid[first] & valid[second] & (levels[first] == levels[second])
+        voxels = np.flatnonzero(linked.any(0))
+        if voxels.size == 0:
+            return labels
+
+        # the label a position passes to a neighbour, which is at least the kernel size if the positions are not linked
+        # (branch-free minimum and maximum are much faster than selecting the labels by the links)
+        blocked = np.where(linked.take(voxels, 1), 0, kernel_size).astype(labels.dtype)
+        edges = [(p, q, blocked[e]) for e, (p, q) in enumerate(self._edges) if not blocked[e].all()]
+        voxel_labels = labels.take(voxels, 1)
+        previous_labels = None
+        while previous_labels is None or np.any(previous_labels != voxel_labels):
+            previous_labels = voxel_labels.copy()
+            for p, q, edge_blocked in edges:
+                np.minimum(voxel_labels[q], np.maximum(voxel_labels[p], edge_blocked), out=voxel_labels[q])
+                np.minimum(voxel_labels[p], np.maximum(voxel_labels[q], edge_blocked), out=voxel_labels[p])
+            edges.reverse()  # alternate the sweep direction
+        labels[:, voxels] = voxel_labels
+        return labels
+
+    def _init_calculation(self, voxel_slice: slice):
+        ng = len(self.gray_levels)
+        levels = self.cache.get_kernel_levels(self.bin_width)[:, voxel_slice]
+        valid = self.cache.get_kernel_mask()[:, voxel_slice]
+        kernel_size, no_voxels = levels.shape
+        labels = self._label_zones(levels, valid)
+
+        # count the zone sizes by the label (i.e. the first position) of the zones
+        flat_labels = (np.arange(no_voxels)[np.newaxis, :] * kernel_size + labels)[valid]
+        zone_sizes = np.bincount(flat_labels, minlength=no_voxels * kernel_size).reshape((no_voxels, kernel_size))
+        zone_voxels, zone_labels = np.nonzero(zone_sizes)
+
+        flat_glszm_idx = (zone_voxels * ng + levels[zone_labels, zone_voxels]) * kernel_size + \
+            zone_sizes[zone_voxels, zone_labels] - 1
+        self.p_glszm = np.bincount(flat_glszm_idx, minlength=no_voxels * ng * kernel_size).reshape(
+            (no_voxels, ng, kernel_size)).astype(float)
+
+        self._calculate_coefficients()
+
+    def _calculate_coefficients(self):
+        """Calculates the coefficients shared by the GLSZM features."""
+        ps = np.sum(self.p_glszm, 1)  # shape (voxels, kernel size)
+        pg = np.sum(self.p_glszm, 2)  # shape (voxels, ng)
+        ivector = self.gray_levels.astype(float)
+        jvector = np.arange(1, self.p_glszm.shape[2] + 1, dtype=float)
+
+        nz = np.sum(ps, 1)  # number of zones
+        nz[nz == 0] = 1
+        n_p = np.sum(ps * jvector[np.newaxis, :], 1)  # number of voxels
+        n_p[n_p == 0] = 1
+
+        self.coefficients = {'ps': ps, 'pg': pg, 'ivector': ivector, 'jvector': jvector, 'nz': nz, 'np': n_p}
+
+    def getSmallAreaEmphasisFeatureValue(self):
+        ps, jvector, nz = self.coefficients['ps'], self.coefficients['jvector'], self.coefficients['nz']
+        return np.sum(ps / (jvector[np.newaxis, :] ** 2), 1) / nz
+
+    def getLargeAreaEmphasisFeatureValue(self):
+        ps, jvector, nz = self.coefficients['ps'], self.coefficients['jvector'], self.coefficients['nz']
+        return np.sum(ps * (jvector[np.newaxis, :] ** 2), 1) / nz
+
+    def getGrayLevelNonUniformityFeatureValue(self):
+        return np.sum(self.coefficients['pg'] ** 2, 1) / self.coefficients['nz']
+
+    def getGrayLevelNonUniformityNormalizedFeatureValue(self):
+        return np.sum(self.coefficients['pg'] ** 2, 1) / self.coefficients['nz'] ** 2
+
+    def getSizeZoneNonUniformityFeatureValue(self):
+        return np.sum(self.coefficients['ps'] ** 2, 1) / self.coefficients['nz']
+
+    def getSizeZoneNonUniformityNormalizedFeatureValue(self):
+        return np.sum(self.coefficients['ps'] ** 2, 1) / self.coefficients['nz'] ** 2
+
+    def getZonePercentageFeatureValue(self):
+        return self.coefficients['nz'] / self.coefficients['np']
+
+    def getGrayLevelVarianceFeatureValue(self):
+        ivector = self.coefficients['ivector'][np.newaxis, :]
+        pg = self.coefficients['pg'] / self.coefficients['nz'][:, np.newaxis]
+        u_i = np.sum(pg * ivector, 1, keepdims=True)
+        return np.sum(pg * (ivector - u_i) ** 2, 1)
+
+    def getZoneVarianceFeatureValue(self):
+        jvector = self.coefficients['jvector'][np.newaxis, :]
+        ps = self.coefficients['ps'] / self.coefficients['nz'][:, np.newaxis]
+        u_j = np.sum(ps * jvector, 1, keepdims=True)
+        return np.sum(ps * (jvector - u_j) ** 2, 1)
+
+    def getZoneEntropyFeatureValue(self):
+        eps = np.spacing(1)
+        p_glszm = self.p_glszm / self.coefficients['nz'][:, np.newaxis, np.newaxis]
+        return -np.sum(p_glszm * np.log2(p_glszm + eps), (1, 2))
+
+    def getLowGrayLevelZoneEmphasisFeatureValue(self):
+        pg, ivector, nz = self.coefficients['pg'], self.coefficients['ivector'], self.coefficients['nz']
+        return np.sum(pg / (ivector[np.newaxis, :] ** 2), 1) / nz
+
+    def getHighGrayLevelZoneEmphasisFeatureValue(self):
+        pg, ivector, nz = self.coefficients['pg'], self.coefficients['ivector'], self.coefficients['nz']
+        return np.sum(pg * (ivector[np.newaxis, :] ** 2), 1) / nz
+
+    def _get_area_gray_level_emphasis(self, gray_level_power: int, area_power: int):
+        ivector = self.coefficients['ivector'][np.newaxis, :, np.newaxis]
+        jvector = self.coefficients['jvector'][np.newaxis, np.newaxis, :]
+        weights = (ivector ** 2) ** gray_level_power * (jvector ** 2) ** area_power
+        return np.sum(self.p_glszm * weights, (1, 2)) / self.coefficients['nz']
+
+    def getSmallAreaLowGrayLevelEmphasisFeatureValue(self):
+        return self._get_area_gray_level_emphasis(-1, -1)
+
+    def getSmallAreaHighGrayLevelEmphasisFeatureValue(self):
+        return self._get_area_gray_level_emphasis(1, -1)
+
+    def getLargeAreaLowGrayLevelEmphasisFeatureValue(self):
+        return self._get_area_gray_level_emphasis(-1, 1)
+
+    def getLargeAreaHighGrayLevelEmphasisFeatureValue(self):
+        return self._get_area_gray_level_emphasis(1, 1)
@@ -0,0 +1,154 @@
+"""This module contains a persistent on-disk cache of pre-processed images and their feature matrices."""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import typing as t
+
+import numpy as np
+import SimpleITK as sitk
+import pymia.data.conversion as conversion
+
+import mialab.data.structure as structure
+
+# the parameters of pre_process, which do not change the pre-processed images or the feature matrix
+IGNORED_PARAMS = ('feature_cache_dir', 'feature_cache_size', 'feature_matrix_dir', 'feature_workers',
+                  'modality_workers', 'n_estimators', 'max_depth')
+
+CACHE_VERSION = 2  # increment to invalidate all cache entries, e.g. if the feature extraction changes
+
+
+class FeatureCache:
+    """Represents a persistent, content-addressed cache of pre-processed brain images.
+
+    Each entry is a directory named by its key, which contains the pre-processed images (``<image type>.mha``),
+    the feature matrix (``features.npy`` and ``labels.npy``, loaded as read-only memory maps) and the meta data
+    (``meta.json``). The least recently used entries are evicted if the cache exceeds its maximum size.
+    """
+
+    def __init__(self, directory: str, max_size: int = 10 * 1024 ** 3):
+        """Initializes a new instance of the FeatureCache class.
+
+        Args:
+            directory (str): The cache directory.
+            max_size (int): The maximum size of the cache in bytes.
+        """
+        if max_size <= 0:
+            raise ValueError('max_size needs to be positive')
+
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def get_key(paths: dict, params: dict, atlas_images: t.Sequence[sitk.Image] = ()) -> str:
+        """Gets the cache key of an image.
+
+        The key hashes the content of the image files (including the registration transform), the atlas images as
+        well as the pre-processing and feature parameters.
+
+        Args:
+            paths (dict): The paths to the image files, where the key is a
+                :class:`BrainImageTypes <data.structure.BrainImageTypes>` (directories are ignored).
+            params (dict): The pre-processing parameters (see :py:func:`pipeline_utilities.pre_process`).
+            atlas_images (Sequence[sitk.Image]): The atlas images the images are registered to.
+
+        Returns:
+            str: The key.
+        """
+        files = {}
+        for key, path in paths.items():
+            if os.path.isfile(path):
+                file_hash = hashlib.sha256()
+                with open(path, 'rb') as file:
+                    for chunk in iter(lambda: file.read(1024 ** 2), b''):
+                        file_hash.update(chunk)
+                files[str(key)] = file_hash.hexdigest()
+
+        atlases = [[sitk.Hash(atlas), atlas.GetOrigin(), atlas.GetSpacing(), atlas.GetDirection()]
+                   for atlas in atlas_images if atlas.GetNumberOfPixels() > 0]
+
+        content = {'version': CACHE_VERSION,
+                   'files': files,
+                   'atlases': atlases,
+                   'params': {key: value for key, value in params.items() if key not in IGNORED_PARAMS}}
+        content = json.dumps(content, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def load(self, key: str, id_: str, path: str, transform: sitk.Transform) -> t.Union[structure.BrainImage, None]:
+        """Loads a cached image.
+
+        Args:
+            key (str): The cache key (see :py:meth:`get_key`).
+            id_ (str): The image identifier.
+            path (str): The path to the image directory.
+            transform (sitk.Transform): The registration transform of the image.
+
+        Returns:
+            structure.BrainImage: The pre-processed image with its feature matrix or None if the key is not cached.
+        """
+        entry_dir = os.path.join(self.directory, key)
+        if not os.path.isdir(entry_dir):
+            return None
+
+        with open(os.path.join(entry_dir, 'meta.json'), 'r') as file:
+            meta = json.load(file)
+
+        images = {structure.BrainImageTypes[name]: sitk.ReadImage(os.path.join(entry_dir, name + '.mha'))
+                  for name in meta['images']}
+        img = structure.BrainImage(id_, path, images, transform)
+        img.image_properties = conversion.ImageProperties(img.images[structure.BrainImageTypes.T1w])
+        img.roi = meta['roi']
+        img.feature_names = meta['feature_names']
+        img.feature_matrix = (np.load(os.path.join(entry_dir, 'features.npy'), mmap_mode='r'),
+                              np.load(os.path.join(entry_dir, 'labels.npy'), mmap_mode='r'))
+
+        os.utime(entry_dir)  # mark the entry as recently used
+        return img
+
+    def store(self, key: str, img: structure.BrainImage):
+        """Stores a pre-processed image and its feature matrix.
+
+        The entry is written to a temporary directory and renamed, such that concurrent processes never load
+        incomplete entries.
+
+        Args:
+            key (str): The cache key (see :py:meth:`get_key`).
+            img (structure.BrainImage): The pre-processed image with its feature matrix.
+        """
+        entry_dir = os.path.join(self.directory, key)
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+        try:
+            for image_type, image in img.images.items():
+                sitk.WriteImage(image, os.path.join(tmp_dir, image_type.name + '.mha'))
+            np.save(os.path.join(tmp_dir, 'features.npy'), np.ascontiguousarray(img.feature_matrix[0]))
+            np.save(os.path.join(tmp_dir, 'labels.npy'), np.ascontiguousarray(img.feature_matrix[1]))
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w') as file:
+                json.dump({'id': img.id_,
+                           'images': [image_type.name for image_type in img.images],
+                           'roi': img.roi,
+                           'feature_names': img.feature_names}, file)
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # the entry already exists (e.g. stored by another process) or cannot be written
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self.evict()
+
+    def evict(self):
+        """Evicts the least recently used entries until the cache does not exceed its maximum size."""
+        entries = []
+        for name in os.listdir(self.directory):
+            entry_dir = os.path.join(self.directory, name)
+            if name.startswith('.') or not os.path.isdir(entry_dir):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+            entries.append((os.stat(entry_dir).st_mtime, size, entry_dir))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_size -= size
@@ -0,0 +1,247 @@
+"""This module contains a declarative feature registry and a planner, which compiles the enabled features into an
+execution graph.
+
+Each :class:`FeatureSpec` declares how a feature (or an intermediate result shared between features, e.g. the
+discretized image of the texture features) is computed: its inputs, its output, the data type and number of
+components of its result and its estimated cost. A :class:`FeaturePlan` selects the enabled features of a registry,
+adds the intermediates they depend on (each only once), orders them topologically and executes independent nodes
+concurrently.
+"""
+import concurrent.futures
+import typing as t
+
+import numpy as np
+
+
+class FeatureSpec:
+    """Represents the declaration of a feature or an intermediate result of the feature extraction."""
+
+    def __init__(self, name: str, function: t.Callable, inputs=(), output=None, dtype=np.float32, components=1,
+                 cost=1.0, enabled: t.Callable = None):
+        """Initializes a new instance of the FeatureSpec class.
+
+        The arguments ``inputs``, ``components`` and ``cost`` are either values or callables, which get the context
+        (e.g. the feature extractor) and return the value, such that they can depend on the parameters.
+
+        Args:
+            name (str): The unique node name.
+            function (callable): The function computing the result, which gets the context and the input values.
+            inputs (tuple): The names of the input nodes or sources.
+            output: The identifier of the feature (e.g. a FeatureImageTypes) or None for an intermediate result.
+            dtype: The data type of the result or None if the result is not allocated (e.g. it is an input).
+            components (int): The number of components per voxel of the result.
+            cost (float): The estimated cost per voxel relative to the other nodes, expensive nodes are started first.
+            enabled (callable): Gets the context and returns whether the feature is enabled (outputs only).
+        """
+        self.name = name
+        self.function = function
+        self.inputs = inputs
+        self.output = output
+        self.dtype = dtype
+        self.components = components
+        self.cost = cost
+        self.enabled = enabled
+
+    @staticmethod
+    def _resolve(value, context):
+        return value(context) if callable(value) else value
+
+    def get_inputs(self, context) -> tuple:
+        """Gets the names of the input nodes or sources."""
+        return tuple(self._resolve(self.inputs, context))
+
+    def get_cost(self, context) -> float:
+        """Gets the estimated cost per voxel."""
+        return self._resolve(self.cost, context)
+
+    def get_components(self, context) -> int:
+        """Gets the number of components per voxel of the result."""
+        return int(self._resolve(self.components, context))
+
+    def get_memory(self, context, number_of_voxels: int) -> int:
+        """Gets the estimated memory of the result in bytes."""
+        if self.dtype is None:
+            return 0
+        return self.get_components(context) * number_of_voxels * np.dtype(self.dtype).itemsize
+
+    def __str__(self):
+        """Gets a printable string representation.
+
+        Returns:
+            str: String representation.
+        """
+        return 'FeatureSpec:\n' \
+               ' name:   {self.name}\n' \
+               ' inputs: {self.inputs}\n' \
+               ' output: {self.output}\n' \
+            .format(self=self)
+
+
+class FeaturePlan:
+    """Represents the execution graph of the enabled features of a registry."""
+
+    def __init__(self, registry: t.Sequence[FeatureSpec], context, sources: t.Iterable[str]):
+        """Initializes a new instance of the FeaturePlan class and compiles the graph.
+
+        Args:
+            registry (Sequence[FeatureSpec]): The registered features and intermediates. The order of the outputs
+                is the order of the registry.
+            context: The context passed to the functions of the specifications, e.g. the feature extractor.
+            sources (Iterable[str]): The names of the inputs provided on execution, e.g. the images.
+
+        Raises:
+            ValueError: If a name is registered twice, an input is unknown or the graph is cyclic.
+        """
+        self.context = context
+        self.sources = set(sources)
+
+        specs = {}
+        for spec in registry:
+            if spec.name in specs or spec.name in self.sources:
+                raise ValueError('feature "{}" is registered twice'.format(spec.name))
+            specs[spec.name] = spec
+
+        self.outputs = [spec.name for spec in registry if spec.output is not None and spec.enabled(context)]
+
+        # collect the required nodes in topological order, where shared intermediates are added only once
+        self.nodes = []  # type: t.List[FeatureSpec]
+        self.inputs = {}  # the input names of each node
+        visiting = set()
+
+        def visit(name: str):
+            if name in self.sources or name in self.inputs:
+                return
+            if name not in specs:
+                raise ValueError('unknown feature input "{}"'.format(name))
+            if name in visiting:
+                raise ValueError('cyclic feature dependency of "{}"'.format(name))
+            visiting.add(name)
+            spec = specs[name]
+            inputs = spec.get_inputs(context)
+            for input_name in inputs:
+                visit(input_name)
+            visiting.remove(name)
+            self.inputs[name] = inputs
+            self.nodes.append(spec)
+
+        for name in self.outputs:
+            visit(name)
+
+        # the nodes, which use the result of each node
+        self.consumers = {spec.name: [] for spec in self.nodes}
+        for spec in self.nodes:
+            for input_name in self.inputs[spec.name]:
+                if input_name in self.consumers:
+                    self.consumers[input_name].append(spec.name)
+
+    def get_levels(self) -> t.Dict[str, int]:
+        """Gets the level of each node, i.e. the length of the longest path from the sources.
+
+        Nodes of the same level are independent of each other.
+        """
+        levels = {}
+        for spec in self.nodes:
+            levels[spec.name] = 1 + max((levels[name] for name in self.inputs[spec.name] if name in levels), default=-1)
+        return levels
+
+    def get_peak_memory(self, number_of_voxels: int) -> int:
+        """Estimates the peak memory of the execution.
+
+        The estimate assumes that the nodes of a level run concurrently, that the outputs are kept until the end and
+        that the intermediates are released after their last consumer.
+
+        Args:
+            number_of_voxels (int): The number of voxels of the images.
+
+        Returns:
+            int: The estimated peak memory in bytes (excluding the sources).
+        """
+        levels = self.get_levels()
+        memory = {spec.name: spec.get_memory(self.context, number_of_voxels) for spec in self.nodes}
+        last_use = {name: max([levels[consumer] for consumer in consumers] + [levels[name]])
+                    for name, consumers in self.consumers.items()}
+
+        peak = 0
+        for level in range(max(levels.values(), default=-1) + 1):
+            live = sum(memory[name] for name in levels if levels[name] <= level and
+                       (name in self.outputs or last_use[name] >= level))
+            peak = max(peak, live)
+        return peak
+
+    def get_cost(self, number_of_voxels: int) -> float:
+        """Gets the estimated total cost of the execution."""
+        return sum(spec.get_cost(self.context) for spec in self.nodes) * number_of_voxels
+
+    def execute(self, sources: dict, workers: int = 1, callback: t.Callable = None) -> dict:
+        """Executes the plan.
+
+        Args:
+            sources (dict): The values of the sources, where the key is the source name.
+            workers (int): The number of nodes executed concurrently by a thread pool, 1 executes them one by one.
+            callback (callable): Gets the output identifier and the result of each output as soon as it is computed,
+                called by the thread executing the node.
+
+        Returns:
+            dict: The results of the outputs in the order of the registry, where the key is the output identifier.
+        """
+        if workers < 1:
+            raise ValueError('the number of workers needs to be at least 1')
+
+        values = dict(sources)
+        remaining_consumers = {name: len(consumers) for name, consumers in self.consumers.items()}
+
+        def release_inputs(name: str):
+            # release intermediates as soon as all their consumers are done
+            for input_name in self.inputs[name]:
+                if input_name in remaining_consumers:
+                    remaining_consumers[input_name] -= 1
+                    if remaining_consumers[input_name] == 0 and input_name not in self.outputs:
+                        del values[input_name]
+
+        def run(spec: FeatureSpec):
+            value = spec.function(self.context, *[values[name] for name in self.inputs[spec.name]])
+            if callback is not None and spec.name in self.outputs:
+                callback(spec.output, value)
+            return value
+
+        if workers == 1:
+            for spec in self.nodes:
+                values[spec.name] = run(spec)
+                release_inputs(spec.name)
+        else:
+            pending = {spec.name: spec for spec in self.nodes}
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                running = {}
+                while pending or running:
+                    # start the nodes whose inputs are available, the expensive ones first
+                    ready = [spec for spec in pending.values()
+                             if all(name in values for name in self.inputs[spec.name])]
+                    for spec in sorted(ready, key=lambda s: s.get_cost(self.context), reverse=True):
+                        del pending[spec.name]
+                        running[executor.submit(run, spec)] = spec.name
+
+                    done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        values[name] = future.result()
+                        release_inputs(name)
+
+        return {self.nodes_by_name[name].output: values[name] for name in self.outputs}
+
+    @property
+    def nodes_by_name(self) -> t.Dict[str, FeatureSpec]:
+        """Gets the nodes, where the key is the node name."""
+        return {spec.name: spec for spec in self.nodes}
+
+    def __str__(self):
+        """Gets a printable string representation.
+
+        Returns:
+            str: String representation.
+        """
+        levels = self.get_levels()
+        lines = ['FeaturePlan:']
+        for spec in self.nodes:
+            lines.append(' {}{} <- {}'.format('  ' * levels[spec.name], spec.name,
+                                              ', '.join(self.inputs[spec.name]) or '-'))
+        return '\n'.join(lines)
@@ -1,4 +1,5 @@
 """Module for the management of multi-process function calls."""
+import mmap
 import typing as t
 
 import numpy as np
@@ -22,6 +23,48 @@ class PicklableAffineTransform:
         return transform
 
 
+class PicklableMemmap:
+    """Represents a memory-mapped .npy file that can be pickled, which is mapped again by the receiving process."""
+
+    def __init__(self, arr: np.memmap):
+        arr.flush()  # the receiving process reads the file
+        self.filename = arr.filename
+        self.mode = 'r' if arr.mode == 'r' else 'r+'
+
+    def get_array(self) -> np.memmap:
+        """Maps the file again."""
+        return np.load(self.filename, mmap_mode=self.mode)
+
+    @staticmethod
+    def make_picklable(arr):
+        """Replaces an array mapping a whole .npy file by a :class:`PicklableMemmap`, copies other memory maps and
+        keeps all other arrays.
+
+        Args:
+            arr: The array (or any other object).
+
+        Returns:
+            The picklable array.
+        """
+        if not isinstance(arr, np.memmap):
+            return arr
+        if isinstance(arr.base, mmap.mmap) and arr.filename is not None and arr.filename.endswith('.npy'):
+            return PicklableMemmap(arr)
+        return np.array(arr)  # e.g. a view of a memory map, whose mmap cannot be pickled
+
+    @staticmethod
+    def recover(arr):
+        """Maps a :class:`PicklableMemmap` again and keeps all other arrays.
+
+        Args:
+            arr: The picklable array (or any other object).
+
+        Returns:
+            The array.
+        """
+        return arr.get_array() if isinstance(arr, PicklableMemmap) else arr
+
+
 class PicklableBrainImage:
     """Represents a brain image that can be pickled."""
 
@@ -40,10 +83,12 @@ class PicklableBrainImage:
         self.path = path
         self.np_images = np_images
         self.image_properties = image_properties
+        self.roi = None
         self.np_feature_images = {}
         self.feature_matrix = None  # a tuple (features, labels),
         # where the shape of features is (n, number_of_features) and the shape of labels is (n, 1)
         # with n being the amount of voxels
+        self.feature_names = []
         self.pickable_transform = PicklableAffineTransform(transform)
 
 
@@ -72,7 +117,12 @@ class BrainImageToPicklableBridge:
                                                    brain_image.image_properties,
                                                    brain_image.transformation)
         pickable_brain_image.np_feature_images = np_feature_images
-        pickable_brain_image.feature_matrix = brain_image.feature_matrix
+        if brain_image.feature_matrix is not None:
+            # the feature matrix may be memory-mapped (e.g. loaded from the feature cache), whose mmap cannot be pickled
+            pickable_brain_image.feature_matrix = tuple(PicklableMemmap.make_picklable(arr)
+                                                        for arr in brain_image.feature_matrix)
+        pickable_brain_image.roi = brain_image.roi
+        pickable_brain_image.feature_names = brain_image.feature_names
 
         return pickable_brain_image
 
@@ -103,7 +153,11 @@ class PicklableToBrainImageBridge:
         transform = picklable_brain_image.pickable_transform.get_sitk_transformation()
 
         brain_image = structure.BrainImage(picklable_brain_image.id_, picklable_brain_image.path, images, transform)
-        brain_image.feature_matrix = picklable_brain_image.feature_matrix
+        if picklable_brain_image.feature_matrix is not None:
+            brain_image.feature_matrix = tuple(PicklableMemmap.recover(arr)
+                                               for arr in picklable_brain_image.feature_matrix)
+        brain_image.roi = picklable_brain_image.roi
+        brain_image.feature_names = picklable_brain_image.feature_names
         return brain_image
 
 
@@ -1,5 +1,6 @@
 """This module contains utility classes and functions."""
 import enum
+import hashlib
 import os
 import typing as t
 
@@ -15,6 +16,9 @@ import mialab.data.structure as structure
 import mialab.filtering.feature_extraction as fltr_feat
 import mialab.filtering.postprocessing as fltr_postp
 import mialab.filtering.preprocessing as fltr_prep
+import mialab.filtering.texture as fltr_tex
+import mialab.utilities.feature_cache as fcache
+import mialab.utilities.feature_plan as fplan
 import mialab.utilities.multi_processor as mproc
 
 atlas_t1 = sitk.Image()
@@ -57,6 +61,191 @@ class FeatureImageTypes(enum.Enum):
     T2w_GLSZM = 11  # GLSZM feature for T1-weighted images
 
 
+def get_roi(mask: sitk.Image, padding: int = 0) -> t.Tuple[t.List[int], t.List[int]]:
+    """Gets the bounding box of a mask as region of interest.
+
+    Args:
+        mask (sitk.Image): The mask, where non-zero voxels are inside the mask.
+        padding (int): The number of voxels the bounding box is padded with on each side (clipped to the image).
+
+    Returns:
+        tuple: The (x, y, z) index and size of the region of interest as used by ``sitk.RegionOfInterest``.
+    """
+    mask_arr = sitk.GetArrayViewFromImage(mask)
+    coordinates = np.nonzero(mask_arr)
+    if coordinates[0].size == 0:
+        raise ValueError('the mask is empty')
+
+    # numpy arrays are indexed (z, y, x), SimpleITK images (x, y, z)
+    start = np.maximum([c.min() - padding for c in coordinates], 0)[::-1]
+    stop = np.minimum([c.max() + 1 + padding for c in coordinates], mask_arr.shape)[::-1]
+    return [int(i) for i in start], [int(s) for s in stop - start]
+
+
+def crop_roi(image: sitk.Image, roi: t.Tuple[t.List[int], t.List[int]]) -> sitk.Image:
+    """Crops an image to a region of interest.
+
+    Args:
+        image (sitk.Image): The image.
+        roi (tuple): The (x, y, z) index and size of the region of interest (see :py:func:`get_roi`).
+
+    Returns:
+        sitk.Image: The cropped image, which keeps its physical position.
+    """
+    index, size = roi
+    return sitk.RegionOfInterest(image, size, index)
+
+
+def scatter_roi(values: np.ndarray, img: structure.BrainImage, fill_value=0) -> np.ndarray:
+    """Scatters the voxel-wise values of the region of interest (e.g. predictions) to all voxels of the image.
+
+    Args:
+        values (np.ndarray): The values of the voxels of the region of interest of shape (n, ...), e.g. the predictions
+            or probabilities of the feature matrix rows.
+        img (structure.BrainImage): The image, of which the features were extracted from the region of interest.
+        fill_value: The value of the voxels outside the region of interest, e.g. the background label.
+
+    Returns:
+        np.ndarray: The values of all voxels of shape (number of voxels, ...), e.g. to be converted by
+        ``NumpySimpleITKImageBridge.convert``.
+    """
+    if img.roi is None:
+        return values
+
+    (x, y, z), (size_x, size_y, size_z) = img.roi
+    image_size = img.image_properties.size  # (x, y, z)
+    all_values = np.full((image_size[2], image_size[1], image_size[0]) + values.shape[1:], fill_value,
+                         dtype=values.dtype)
+    all_values[z:z + size_z, y:y + size_y, x:x + size_x] = values.reshape((size_z, size_y, size_x) + values.shape[1:])
+    return all_values.reshape((-1,) + values.shape[1:])
+
+
+def get_subject_rng(seed: int, id_: str) -> np.random.Generator:
+    """Gets the random number generator of a subject.
+
+    The generator is seeded by a ``np.random.SeedSequence`` of the base seed and a hash of the subject identifier, such
+    that the random numbers of a subject do not depend on the order or the process, in which the subjects are
+    processed, nor on retries.
+
+    Args:
+        seed (int): The base seed, e.g. of the experiment.
+        id_ (str): The subject identifier.
+
+    Returns:
+        np.random.Generator: The random number generator.
+    """
+    subject_key = int.from_bytes(hashlib.sha256(id_.encode()).digest()[:8], 'little')
+    return np.random.default_rng(np.random.SeedSequence([seed, subject_key]))
+
+
+def _extract_atlas_coordinates(extractor: 'FeatureExtractor') -> sitk.Image:
+    atlas_coordinates = fltr_feat.AtlasCoordinates().execute(extractor.img.images[structure.BrainImageTypes.T1w])
+    if extractor.img.roi is not None:
+        # the atlas coordinates are unscaled voxel indices relative to the origin of the whole image (not mm),
+        # hence computed on the whole image before cropping
+        atlas_coordinates = crop_roi(atlas_coordinates, extractor.img.roi)
+    return atlas_coordinates
+
+
+def _extract_intensity(extractor: 'FeatureExtractor', image: sitk.Image) -> sitk.Image:
+    return image
+
+
+def _extract_gradient_intensity(extractor: 'FeatureExtractor', image: sitk.Image) -> sitk.Image:
+    return sitk.GradientMagnitude(image)
+
+
+def _get_texture_cache(extractor: 'FeatureExtractor', image: sitk.Image, brain_mask: sitk.Image,
+                       training_mask: np.ndarray) -> fltr_tex.TextureCache:
+    # share the mask voxels, kernels and discretization of the modality between the texture feature classes
+    return fltr_tex.TextureCache(image, brain_mask, voxel_mask=training_mask)
+
+
+# the texture feature classes of the backends, where the key is the feature type
+TEXTURE_FEATURE_CLASSES = {'native': {'GLCM': fltr_tex.VoxelBasedGLCM,
+                                      'FO': fltr_tex.VoxelBasedFirstOrder,
+                                      'GLSZM': fltr_tex.VoxelBasedGLSZM},
+                           'pyradiomics': {'GLCM': glcm.RadiomicsGLCM,
+                                           'FO': firstorder.RadiomicsFirstOrder,
+                                           'GLSZM': glszm.RadiomicsGLSZM}}
+
+# the estimated cost per voxel of the texture feature types relative to the gradient magnitude
+TEXTURE_FEATURE_COSTS = {'GLCM': 20.0, 'FO': 5.0, 'GLSZM': 50.0}
+
+
+def _texture_feature_extractor(feature_type: str) -> t.Callable:
+    def extract(extractor: 'FeatureExtractor', image: sitk.Image, brain_mask: sitk.Image,
+                texture_cache: fltr_tex.TextureCache = None) -> fltr_tex.FeatureMap:
+        texture_settings = {'voxelBased': True}
+        if texture_cache is not None:
+            # the features are calculated at the voxels of the cache, e.g. the training voxels only
+            texture_settings['textureCache'] = texture_cache
+            texture_settings['voxelMask'] = texture_cache.voxel_mask
+
+        # Enable the texture features based on the specified feature parameters
+        feature_class = TEXTURE_FEATURE_CLASSES[extractor.texture_backend][feature_type]
+        features = feature_class(image, brain_mask, **texture_settings)
+        features.enabledFeatures = dict(extractor.get_texture_parameters(feature_type))
+
+        if isinstance(features, fltr_tex.VoxelBasedFeaturesBase):
+            # all enabled features are evaluated from the same texture matrix of each voxel
+            return features.executeFeatureMap()
+
+        # Execute the texture feature extraction and store the features as composite image
+        feature_map = fltr_tex.FeatureMap.from_images(features.execute())
+        feature_map.image.CopyInformation(image)
+        return feature_map
+
+    return extract
+
+
+def _modality_feature_specs(modality: str, feature_type: str) -> t.List[fplan.FeatureSpec]:
+    """Gets the specifications of a feature type of a modality.
+
+    Args:
+        modality (str): The modality ('T1w' or 'T2w').
+        feature_type (str): The feature type, e.g. 'GLCM' or 'TEXTURE_CACHE' (the intermediate shared by the native
+            texture features).
+
+    Returns:
+        List[fplan.FeatureSpec]: The specifications.
+    """
+    if feature_type == 'TEXTURE_CACHE':
+        return [fplan.FeatureSpec('{}_TEXTURE_CACHE'.format(modality), _get_texture_cache,
+                                  (modality, 'BrainMask', 'TRAINING_MASK'), dtype=np.uint8,
+                                  components=27, cost=2.0)]  # the discretized 3x3x3 kernel of each voxel
+
+    output = FeatureImageTypes['{}_{}'.format(modality, feature_type)]
+    if feature_type == 'INTENSITY':
+        return [fplan.FeatureSpec(output.name, _extract_intensity, (modality,), output, dtype=None, cost=0.0,
+                                  enabled=lambda extractor: extractor.intensity_feature)]
+    if feature_type == 'GRADIENT_INTENSITY':
+        return [fplan.FeatureSpec(output.name, _extract_gradient_intensity, (modality,), output, cost=1.0,
+                                  enabled=lambda extractor: extractor.gradient_intensity_feature)]
+
+    def inputs(extractor: 'FeatureExtractor') -> tuple:
+        if extractor.texture_backend == 'native':
+            return modality, 'BrainMask', '{}_TEXTURE_CACHE'.format(modality)
+        return modality, 'BrainMask'
+
+    return [fplan.FeatureSpec(output.name, _texture_feature_extractor(feature_type), inputs, output,
+                              dtype=np.float32,
+                              components=lambda extractor: len(extractor.get_enabled_texture_features(feature_type)),
+                              cost=TEXTURE_FEATURE_COSTS[feature_type],
+                              enabled=lambda extractor: getattr(extractor, feature_type + '_features'))]
+
+
+# the registry of the features, the order defines the order of the features in the feature matrix. It is the order of
+# the former feature extraction: the atlas coordinates, the T1w and T2w intensities, the T1w and T2w gradient
+# intensities, and the T1w and T2w features of each texture feature type (GLCM, FO and GLSZM). Changing it changes the
+# columns expected by trained forests
+FEATURE_REGISTRY = [fplan.FeatureSpec(FeatureImageTypes.ATLAS_COORD.name, _extract_atlas_coordinates, (),
+                                      FeatureImageTypes.ATLAS_COORD, dtype=np.float32, components=3, cost=1.0,
+                                      enabled=lambda extractor: extractor.coordinates_feature)] + \
+                   [spec for feature_type in ('INTENSITY', 'GRADIENT_INTENSITY', 'GLCM', 'FO', 'GLSZM', 'TEXTURE_CACHE')
+                    for modality in ('T1w', 'T2w') for spec in _modality_feature_specs(modality, feature_type)]
+
+
 class FeatureExtractor:
     """Represents a feature extractor."""
 
@@ -68,6 +257,32 @@ class FeatureExtractor:
         """
         self.img = img
         self.training = kwargs.get('training', True)
+
+        # the base seed of the subject random number generators (see get_subject_rng), None draws the training voxels
+        # from the global NumPy random state
+        self.random_seed = kwargs.get('random_seed', None)
+
+        # the sampling of the training voxels, either 'random' (a percentage of the voxels of each label) or 'boundary'
+        # (a budget of voxels of each label, preferring voxels close to the label boundaries)
+        self.training_sampling = kwargs.get('training_sampling', 'random')
+        if self.training_sampling not in ('random', 'boundary'):
+            raise ValueError('unknown training sampling "{}"'.format(self.training_sampling))
+        self.label_budgets = kwargs.get('label_budgets', None)
+        if self.training_sampling == 'boundary' and self.label_budgets is None:
+            raise ValueError('boundary training sampling requires label budgets')
+        self.label_percentages = kwargs.get('label_percentages', [0.0003, 0.004, 0.003, 0.04, 0.04, 0.02])
+
+        # extract the features only from the region of interest of the image (see pre_process), if set
+        self.images = self.img.images
+        if self.img.roi is not None:
+            self.images = {image_type: crop_roi(image, self.img.roi) for image_type, image in self.img.images.items()}
+
+        # all features are single precision from their creation, starting with the intensities
+        self.images = dict(self.images)
+        for image_type in (structure.BrainImageTypes.T1w, structure.BrainImageTypes.T2w):
+            if self.images[image_type].GetPixelID() != sitk.sitkFloat32:
+                self.images[image_type] = sitk.Cast(self.images[image_type], sitk.sitkFloat32)
+
         self.coordinates_feature = kwargs.get('coordinates_feature', False)
         self.intensity_feature = kwargs.get('intensity_feature', False)
         self.gradient_intensity_feature = kwargs.get('gradient_intensity_feature', False)
@@ -82,6 +297,34 @@ class FeatureExtractor:
         self.FO_features_parameters = kwargs.get('FO_features_parameters', {})
         self.GLSZM_features_parameters = kwargs.get('GLSZM_features_parameters', {})
 
+        # get the texture feature backend, either 'pyradiomics' or 'native' (see mialab.filtering.texture)
+        self.texture_backend = kwargs.get('texture_backend', 'pyradiomics')
+        if self.texture_backend not in ('pyradiomics', 'native'):
+            raise ValueError('unknown texture backend "{}"'.format(self.texture_backend))
+
+        # calculate the texture features only at the sampled training voxels instead of the whole brain (training only)
+        self.sparse_texture = kwargs.get('sparse_texture', False)
+        if self.sparse_texture and self.texture_backend != 'native':
+            raise ValueError('sparse texture feature extraction requires the native texture backend')
+        self.training_mask = None
+
+        # the named multi-channel texture feature maps, e.g. to select a subset of the GLCM features without recomputing
+        self.feature_maps = {}
+
+        # the preallocated feature matrix and the columns of each feature image type, written as the features complete
+        self.feature_data = None
+        self.feature_columns = {}
+        self.voxel_indices = None  # the flat indices of the feature matrix voxels, None for all voxels
+
+        # the directory to write the feature matrices of testing images to as memory-mapped .npy files, None keeps
+        # them in memory. Worker processes of pre_process_batch pass the file path, which is mapped again by the parent
+        self.feature_matrix_dir = kwargs.get('feature_matrix_dir', None)
+
+        # the number of independent features (e.g. of the T1w and T2w image) extracted concurrently by a thread pool,
+        # 1 extracts them one by one
+        self.feature_workers = kwargs.get('feature_workers', kwargs.get('modality_workers', 1))
+        if self.feature_workers < 1:
+            raise ValueError('the number of feature workers needs to be at least 1')
 
         # Initialize PyRadiomics feature extractor for GLCM features
         if self.GLCM_features:
@@ -110,248 +353,210 @@ class FeatureExtractor:
         """
         # warnings.warn('No features from T2-weighted image extracted.')
 
-        if self.coordinates_feature:
-            atlas_coordinates = fltr_feat.AtlasCoordinates()
-            self.img.feature_images[FeatureImageTypes.ATLAS_COORD] = \
-                atlas_coordinates.execute(self.img.images[structure.BrainImageTypes.T1w])
-
-        if self.intensity_feature:
-            self.img.feature_images[FeatureImageTypes.T1w_INTENSITY] = self.img.images[structure.BrainImageTypes.T1w]
-            self.img.feature_images[FeatureImageTypes.T2w_INTENSITY] = self.img.images[structure.BrainImageTypes.T2w]
-
-        if self.gradient_intensity_feature:
-            # compute gradient magnitude images
-            self.img.feature_images[FeatureImageTypes.T1w_GRADIENT_INTENSITY] = \
-                sitk.GradientMagnitude(self.img.images[structure.BrainImageTypes.T1w])
-            self.img.feature_images[FeatureImageTypes.T2w_GRADIENT_INTENSITY] = \
-                sitk.GradientMagnitude(self.img.images[structure.BrainImageTypes.T2w])
-
-        # compute GLCM features
-        if self.GLCM_features:
-
-            # Enable GLCM features based on the specified GLCM feature parameters
-            glcmT1w_features = glcm.RadiomicsGLCM(self.img.images[structure.BrainImageTypes.T1w],
-                                                  self.img.images[structure.BrainImageTypes.BrainMask],
-                                                  voxelBased=True)
-
-            # Print the GLCM features that are in use
-            print("GLCM features in use:", [key for key, value in self.GLCM_features_parameters.items() if value])
-
-            # Enable specified GLCM features
-            glcmT1w_features.enabledFeatures = self.GLCM_features_parameters
-
-            # Execute GLCM feature extraction on the T1-weighted image
-            self.img.feature_images[FeatureImageTypes.T1w_GLCM] = glcmT1w_features.execute()
-
-            # Combine individual GLCM features into a composite image (if needed)
-            composite_image_t1 = sitk.Compose(list(self.img.feature_images[FeatureImageTypes.T1w_GLCM].values()))
-
-            # Copy information from the original T1-weighted image
-            composite_image_t1.CopyInformation(self.img.images[structure.BrainImageTypes.T1w])
-
-            # Store the composite image
-            self.img.feature_images[FeatureImageTypes.T1w_GLCM] = composite_image_t1
-
-            # Enable GLCM features based on the specified GLCM feature parameters for T2-weighted image
-            glcmT2w_features = glcm.RadiomicsGLCM(self.img.images[structure.BrainImageTypes.T2w],
-                                                  self.img.images[structure.BrainImageTypes.BrainMask],
-                                                  voxelBased=True)
-
-            # Enable specified GLCM features for T2-weighted image
-            glcmT2w_features.enabledFeatures = self.GLCM_features_parameters
-
-            # Execute GLCM feature extraction on the T2-weighted image
-            self.img.feature_images[FeatureImageTypes.T2w_GLCM] = glcmT2w_features.execute()
-
-            # Combine individual GLCM features into a composite image for T2-weighted (if needed)
-            composite_image_t2 = sitk.Compose(list(self.img.feature_images[FeatureImageTypes.T2w_GLCM].values()))
-
-            # Copy information from the original T2-weighted image
-            composite_image_t2.CopyInformation(self.img.images[structure.BrainImageTypes.T2w])
-
-            # Store the composite image for T2-weighted
-            self.img.feature_images[FeatureImageTypes.T2w_GLCM] = composite_image_t2
-
-        # compute FO features
-        if self.FO_features:
-
-            # Enable FO features based on the specified FO feature parameters
-            foT1w_features = firstorder.RadiomicsFirstOrder(self.img.images[structure.BrainImageTypes.T1w],
-                                                            self.img.images[structure.BrainImageTypes.BrainMask],
-                                                            voxelBased=True)
-
-            # Print the FO features that are in use
-            print("FO features in use:", [key for key, value in self.FO_features_parameters.items() if value])
-
-            # Enable specified FO features
-            foT1w_features.enabledFeatures = self.FO_features_parameters
-
-            # Execute FO feature extraction on the T1-weighted image
-            self.img.feature_images[FeatureImageTypes.T1w_FO] = foT1w_features.execute()
-
-            # Combine individual FO features into a composite image (if needed)
-            composite_image_t1_fo = sitk.Compose(list(self.img.feature_images[FeatureImageTypes.T1w_FO].values()))
-
-            # Copy information from the original T1-weighted image
-            composite_image_t1_fo.CopyInformation(self.img.images[structure.BrainImageTypes.T1w])
-
-            # Store the composite image for T1-weighted FO
-            self.img.feature_images[FeatureImageTypes.T1w_FO] = composite_image_t1_fo
-
-            # Enable FO features based on the specified FO feature parameters for T2-weighted image
-            foT2w_features = firstorder.RadiomicsFirstOrder(self.img.images[structure.BrainImageTypes.T2w],
-                                                            self.img.images[structure.BrainImageTypes.BrainMask],
-                                                            voxelBased=True)
-
-            # Enable specified FO features for T2-weighted image
-            foT2w_features.enabledFeatures = self.FO_features_parameters
-
-            # Execute FO feature extraction on the T2-weighted image
-            self.img.feature_images[FeatureImageTypes.T2w_FO] = foT2w_features.execute()
-
-            # Combine individual FO features into a composite image for T2-weighted (if needed)
-            composite_image_t2_fo = sitk.Compose(list(self.img.feature_images[FeatureImageTypes.T2w_FO].values()))
-
-            # Copy information from the original T2-weighted image
-            composite_image_t2_fo.CopyInformation(self.img.images[structure.BrainImageTypes.T2w])
-
-            # Store the composite image for T2-weighted FO
-            self.img.feature_images[FeatureImageTypes.T2w_FO] = composite_image_t2_fo
+        if self.training:
+            # draw the training voxels beforehand, such that the feature matrix can be preallocated
+            # and the texture kernels are only evaluated at these voxels (if sparse_texture)
+            self.voxel_indices = self._get_training_voxels()
+            if self.sparse_texture:
+                self.training_mask = np.zeros(self.images[structure.BrainImageTypes.GroundTruth].GetSize()[::-1],
+                                              dtype=bool)
+                self.training_mask.flat[self.voxel_indices] = True
+
+        # Print the texture features that are in use
+        for feature_type in ('GLCM', 'FO', 'GLSZM'):
+            if getattr(self, feature_type + '_features'):
+                print(feature_type, "features in use:", self.get_enabled_texture_features(feature_type))
+
+        # compile the enabled features into an execution graph, where shared intermediates are computed once
+        sources = {image_type.name: image for image_type, image in self.images.items()}
+        sources['TRAINING_MASK'] = self.training_mask if self.sparse_texture else None
+        plan = fplan.FeaturePlan(FEATURE_REGISTRY, self, sources.keys())
+        number_of_voxels = self.images[structure.BrainImageTypes.T1w].GetNumberOfPixels()
+        print('Feature plan with {} nodes, planned peak memory {:.1f} MB'.format(
+            len(plan.nodes), plan.get_peak_memory(number_of_voxels) / 1024 ** 2))
+
+        # each feature is written to its columns of the feature matrix as soon as it is computed
+        self._allocate_feature_matrix(plan)
+
+        if self.feature_workers > 1:
+            # SimpleITK filters are multi-threaded themselves, share the threads between the workers
+            default_threads = sitk.ProcessObject.GetGlobalDefaultNumberOfThreads()
+            sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(max(1, default_threads // self.feature_workers))
+            try:
+                features = plan.execute(sources, self.feature_workers, self._write_feature)
+            finally:
+                sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(default_threads)
+        else:
+            features = plan.execute(sources, callback=self._write_feature)
+
+        for feature_image_type, feature in features.items():
+            if isinstance(feature, fltr_tex.FeatureMap):
+                self.feature_maps[feature_image_type] = feature
+                self.img.feature_images[feature_image_type] = feature.image
+            else:
+                self.img.feature_images[feature_image_type] = feature
 
-        # compute GLSZM features
-        if self.GLSZM_features:
+        self._generate_feature_matrix()
+        return self.img
 
-            # Enable GLSZM features based on the specified GLSZM feature parameters
-            glszmT1w_features = glszm.RadiomicsGLSZM(self.img.images[structure.BrainImageTypes.T1w],
-                                                     self.img.images[structure.BrainImageTypes.BrainMask],
-                                                     voxelBased=True)
+    def get_texture_parameters(self, feature_type: str) -> dict:
+        """Gets the parameters of a texture feature type.
 
-            # Print the GLSZM features that are in use
-            print("GLSZM features in use:", [key for key, value in self.GLSZM_features_parameters.items() if value])
+        Args:
+            feature_type (str): The texture feature type ('GLCM', 'FO' or 'GLSZM').
 
-            # Enable specified GLSZM features
-            glszmT1w_features.enabledFeatures = self.GLSZM_features_parameters
+        Returns:
+            dict: The parameters, where the key is the feature name and the value whether the feature is enabled.
+        """
+        return getattr(self, feature_type + '_features_parameters')
 
-            # Execute GLSZM feature extraction on the T1-weighted image
-            self.img.feature_images[FeatureImageTypes.T1w_GLSZM] = glszmT1w_features.execute()
+    def get_enabled_texture_features(self, feature_type: str) -> t.List[str]:
+        """Gets the enabled features of a texture feature type.
 
-            # Combine individual GLSZM features into a composite image (if needed)
-            composite_image_t1_glszm = sitk.Compose(list(self.img.feature_images[FeatureImageTypes.T1w_GLSZM].values()))
+        Args:
+            feature_type (str): The texture feature type ('GLCM', 'FO' or 'GLSZM').
 
-            # Copy information from the original T1-weighted image
-            composite_image_t1_glszm.CopyInformation(self.img.images[structure.BrainImageTypes.T1w])
+        Returns:
+            List[str]: The enabled feature names.
+        """
+        return [key for key, value in self.get_texture_parameters(feature_type).items() if value]
 
-            # Store the composite image for T1-weighted GLSZM
-            self.img.feature_images[FeatureImageTypes.T1w_GLSZM] = composite_image_t1_glszm
+    def _get_training_voxels(self) -> np.ndarray:
+        """Draws the voxels used for training.
 
-            # Enable GLSZM features based on the specified GLSZM feature parameters for T2-weighted image
-            glszmT2w_features = glszm.RadiomicsGLSZM(self.img.images[structure.BrainImageTypes.T2w],
-                                                     self.img.images[structure.BrainImageTypes.BrainMask],
-                                                     voxelBased=True)
+        Returns:
+            np.ndarray: The sorted flat indices of the voxels used for training.
+        """
+        # draw randomized flat indices of the voxels used for training (the voxels of a training mask, see get_mask)
+        # we have following labels:
+        # - 0 (background)
+        # - 1 (white matter)
+        # - 2 (grey matter)
+        # - 3 (Hippocampus)
+        # - 4 (Amygdala)
+        # - 5 (Thalamus)
+
+        # you can exclude background voxels from the training mask generation
+        # mask_background = self.img.images[structure.BrainImageTypes.BrainMask]
+        # and use background_mask=mask_background in get_indices()
+
+        rng = None if self.random_seed is None else get_subject_rng(self.random_seed, self.img.id_)
+        if self.training_sampling == 'boundary':
+            return fltr_feat.BoundaryWeightedTrainingMaskGenerator.get_indices(
+                self.images[structure.BrainImageTypes.GroundTruth],
+                [0, 1, 2, 3, 4, 5],
+                self.label_budgets,
+                rng=rng)
 
-            # Enable specified GLSZM features for T2-weighted image
-            glszmT2w_features.enabledFeatures = self.GLSZM_features_parameters
+        return fltr_feat.RandomizedTrainingMaskGenerator.get_indices(
+            self.images[structure.BrainImageTypes.GroundTruth],
+            [0, 1, 2, 3, 4, 5],
+            self.label_percentages,
+            rng=rng)
 
-            # Execute GLSZM feature extraction on the T2-weighted image
-            self.img.feature_images[FeatureImageTypes.T2w_GLSZM] = glszmT2w_features.execute()
+    def _allocate_feature_matrix(self, plan: fplan.FeaturePlan):
+        """Allocates the feature matrix, whose columns are known from the feature plan.
 
-            # Combine individual GLSZM features into a composite image for T2-weighted (if needed)
-            composite_image_t2_glszm = sitk.Compose(list(self.img.feature_images[FeatureImageTypes.T2w_GLSZM].values()))
+        Args:
+            plan (fplan.FeaturePlan): The feature plan.
+        """
+        start = 0
+        for name in plan.outputs:
+            spec = plan.nodes_by_name[name]
+            components = spec.get_components(self)
+            self.feature_columns[spec.output] = slice(start, start + components)
+            start += components
 
-            # Copy information from the original T2-weighted image
-            composite_image_t2_glszm.CopyInformation(self.img.images[structure.BrainImageTypes.T2w])
+        if self.training:
+            # the features and labels of all images are gathered with the same flat voxel indices
+            number_of_voxels = len(self.voxel_indices)
+        else:
+            number_of_voxels = self.images[structure.BrainImageTypes.T1w].GetNumberOfPixels()
+
+        shape = (number_of_voxels, start)
+        if self.feature_matrix_dir is not None and not self.training:
+            os.makedirs(self.feature_matrix_dir, exist_ok=True)
+            path = os.path.join(self.feature_matrix_dir, '{}_features.npy'.format(self.img.id_))
+            self.feature_data = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=shape)
+        else:
+            self.feature_data = np.empty(shape, dtype=np.float32)
+
+    def _write_feature(self, feature_image_type: FeatureImageTypes, feature):
+        """Writes a feature to its columns of the feature matrix.
 
-            # Store the composite image for T2-weighted GLSZM
-            self.img.feature_images[FeatureImageTypes.T2w_GLSZM] = composite_image_t2_glszm
+        Args:
+            feature_image_type (FeatureImageTypes): The feature image type.
+            feature: The feature image or texture feature map.
+        """
+        image = feature.image if isinstance(feature, fltr_tex.FeatureMap) else feature
+        columns = self.feature_columns[feature_image_type]
+        if image.GetNumberOfComponentsPerPixel() != columns.stop - columns.start:
+            raise ValueError('feature {} has {} components, but {} are planned'.format(
+                feature_image_type.name, image.GetNumberOfComponentsPerPixel(), columns.stop - columns.start))
 
-        self._generate_feature_matrix()
-        return self.img
+        self._image_as_numpy_array(image, self.voxel_indices, out=self.feature_data[:, columns])
 
     def _generate_feature_matrix(self):
         """Generates a feature matrix."""
 
-        mask = None
-        if self.training:
-            # generate a randomized mask where 1 represents voxels used for training
-            # the mask needs to be binary, where the value 1 is considered as a voxel which is to be loaded
-            # we have following labels:
-            # - 0 (background)
-            # - 1 (white matter)
-            # - 2 (grey matter)
-            # - 3 (Hippocampus)
-            # - 4 (Amygdala)
-            # - 5 (Thalamus)
-
-            # you can exclude background voxels from the training mask generation
-            # mask_background = self.img.images[structure.BrainImageTypes.BrainMask]
-            # and use background_mask=mask_background in get_mask()
-
-            mask = fltr_feat.RandomizedTrainingMaskGenerator.get_mask(
-                self.img.images[structure.BrainImageTypes.GroundTruth],
-                [0, 1, 2, 3, 4, 5],
-                [0.0003, 0.004, 0.003, 0.04, 0.04, 0.02])
-
-            # convert the mask to a logical array where value 1 is False and value 0 is True
-            mask = sitk.GetArrayFromImage(mask)
-            mask = np.logical_not(mask)
-
-        # Initialize an empty list to store processed image data
-        image_data_list = []
-
-        # Iterate over the feature images in the BrainImage instance
+        # the features are already written to the preallocated feature matrix
+        feature_names = []
         print('----FEATURES CURRENTLY USED----')
-        for feature_id, feature_image in self.img.feature_images.items():
-            # Use the _image_as_numpy_array method to convert the feature image to a NumPy array
-            feature_data = self._image_as_numpy_array(feature_image, mask)
-
+        for feature_id, columns in self.feature_columns.items():
             print(feature_id)
-            # Append the processed feature data to the list
-            image_data_list.append(feature_data)
+            feature_names.extend(self._get_feature_names(feature_id, columns.stop - columns.start))
 
-        # Concatenate the processed feature data along the specified axis (axis=1)
-        data = np.concatenate(image_data_list, axis=1)
+        # generate labels (note that we assume to have a ground truth even for testing)
+        labels = self._image_as_numpy_array(self.images[structure.BrainImageTypes.GroundTruth], self.voxel_indices)
 
-        # generate features
-        # data = np.concatenate(
-        #     [self._image_as_numpy_array(image, mask) for id_, image in self.img.feature_images.items()],
-        #     axis=1)
+        if isinstance(self.feature_data, np.memmap):
+            # the file is complete, e.g. to be mapped again by the parent of a worker process (see multi_processor)
+            self.feature_data.flush()
+        self.img.feature_matrix = (self.feature_data, labels.astype(np.int16, copy=False))
+        self.img.feature_names = feature_names
 
-        # generate labels (note that we assume to have a ground truth even for testing)
-        labels = self._image_as_numpy_array(self.img.images[structure.BrainImageTypes.GroundTruth], mask)
+    def _get_feature_names(self, feature_id: FeatureImageTypes, number_of_components: int) -> t.List[str]:
+        """Gets the names of the feature matrix columns of a feature image.
 
-        self.img.feature_matrix = (data.astype(np.float32), labels.astype(np.int16))
+        Args:
+            feature_id (FeatureImageTypes): The feature image type.
+            number_of_components (int): The number of components of the feature image.
+
+        Returns:
+            List[str]: The names, e.g. 'T1w_INTENSITY', 'ATLAS_COORD_0' or 'T1w_GLCM_Contrast' for texture features.
+        """
+        if feature_id in self.feature_maps:
+            return ['{}_{}'.format(feature_id.name, name) for name in self.feature_maps[feature_id].names]
+        if number_of_components == 1:
+            return [feature_id.name]
+        return ['{}_{}'.format(feature_id.name, i) for i in range(number_of_components)]
 
     @staticmethod
-    def _image_as_numpy_array(image: sitk.Image, mask: np.ndarray = None):
+    def _image_as_numpy_array(image: sitk.Image, indices: np.ndarray = None, out: np.ndarray = None) -> np.ndarray:
         """Gets an image as numpy array where each row is a voxel and each column is a feature.
 
+        The rows are gathered from a view of the image buffer, i.e. without copying the image beforehand.
+
         Args:
             image (sitk.Image): The image.
-            mask (np.ndarray): A mask defining which voxels to return. True is background, False is a masked voxel.
+            indices (np.ndarray): The flat (z, y, x) indices of the voxels to return, None returns all voxels.
+            out (np.ndarray): The array of shape (number of voxels, number of components) to write the rows to,
+                e.g. the columns of a feature matrix. A new array is returned if None.
 
         Returns:
             np.ndarray: An array where each row is a voxel and each column is a feature.
         """
-
         number_of_components = image.GetNumberOfComponentsPerPixel()  # the number of features for this image
-        no_voxels = np.prod(image.GetSize())
-        image = sitk.GetArrayFromImage(image)
+        image_arr = sitk.GetArrayViewFromImage(image).reshape((-1, number_of_components))
 
-        if mask is not None:
-            no_voxels = np.size(mask) - np.count_nonzero(mask)
+        if indices is None:
+            if out is None:
+                return image_arr.copy()
+            out[...] = image_arr
+            return out
 
-            if number_of_components == 1:
-                masked_image = np.ma.masked_array(image, mask=mask)
-            else:
-                # image is a vector image, make a vector mask
-                vector_mask = np.expand_dims(mask, axis=3)  # shape is now (z, x, y, 1)
-                vector_mask = np.repeat(vector_mask, number_of_components,
-                                        axis=3)  # shape is now (z, x, y, number_of_components)
-                masked_image = np.ma.masked_array(image, mask=vector_mask)
-
-            image = masked_image[~masked_image.mask]
-
-        return image.reshape((no_voxels, number_of_components))
+        # the indices are valid by construction, clipping avoids the buffered bounds check of mode='raise'
+        return np.take(image_arr, indices, axis=0, out=out, mode='clip')
 
 
 def pre_process(id_: str, paths: dict, **kwargs) -> structure.BrainImage:
@@ -363,6 +568,10 @@ def pre_process(id_: str, paths: dict, **kwargs) -> structure.BrainImage:
     - Pre-processing
     - Feature extraction
 
+    If the parameter ``feature_cache_dir`` is set, the processed image is loaded from the
+    :py:class:`feature cache <mialab.utilities.feature_cache.FeatureCache>` if the same image was processed with the
+    same parameters before, and stored otherwise.
+
     Args:
         id_ (str): An image identifier.
         paths (dict): A dict, where the keys are an image identifier of type structure.BrainImageTypes
@@ -374,11 +583,24 @@ def pre_process(id_: str, paths: dict, **kwargs) -> structure.BrainImage:
 
     print('-' * 10, 'Processing', id_)
 
+    cache = None
+    if kwargs.get('feature_cache_dir', None):
+        cache = fcache.FeatureCache(kwargs['feature_cache_dir'], kwargs.get('feature_cache_size', 10 * 1024 ** 3))
+        atlas_images = (atlas_t1, atlas_t2) if kwargs.get('registration_pre', False) else ()
+        cache_key = cache.get_key(paths, kwargs, atlas_images)
+
     # load image
     path = paths.pop(id_, '')  # the value with key id_ is the root directory of the image
     path_to_transform = paths.pop(structure.BrainImageTypes.RegistrationTransform, '')
-    img = {img_key: sitk.ReadImage(path) for img_key, path in paths.items()}
     transform = sitk.ReadTransform(path_to_transform)
+
+    if cache is not None:
+        img = cache.load(cache_key, id_, path, transform)
+        if img is not None:
+            print(' Loaded from feature cache', cache_key)
+            return img
+
+    img = {img_key: sitk.ReadImage(path) for img_key, path in paths.items()}
     img = structure.BrainImage(id_, path, img, transform)
 
     # construct pipeline for brain mask registration
@@ -439,6 +661,10 @@ def pre_process(id_: str, paths: dict, **kwargs) -> structure.BrainImage:
     # update image properties to atlas image properties after registration
     img.image_properties = conversion.ImageProperties(img.images[structure.BrainImageTypes.T1w])
 
+    if kwargs.get('roi_crop', False):
+        # restrict the feature extraction to the padded bounding box of the brain mask
+        img.roi = get_roi(img.images[structure.BrainImageTypes.BrainMask], kwargs.get('roi_padding', 3))
+
     # extract the features
     feature_extractor = FeatureExtractor(img, **kwargs)
     img = feature_extractor.execute
@@ -446,6 +672,9 @@ def pre_process(id_: str, paths: dict, **kwargs) -> structure.BrainImage:
     img.feature_images = {}  # we free up memory because we only need the img.feature_matrix
     # for training of the classifier
 
+    if cache is not None:
+        cache.store(cache_key, img)
+
     return img
 
 
@@ -529,6 +758,28 @@ def pre_process_batch(data_batch: t.Dict[structure.BrainImageTypes, structure.Br
     return images
 
 
+def pre_process_iter(data_batch: t.Dict[structure.BrainImageTypes, structure.BrainImage],
+                     pre_process_params: dict = None) -> t.Iterator[structure.BrainImage]:
+    """Loads and pre-processes a batch of images one by one.
+
+    In contrast to :py:func:`pre_process_batch`, the images are yielded as soon as they are processed, such that
+    they can be released before the next image is processed (e.g. by a
+    :py:class:`ReservoirTrainingSet <mialab.utilities.training_set.ReservoirTrainingSet>`).
+
+    Args:
+        data_batch (Dict[structure.BrainImageTypes, structure.BrainImage]): Batch of images to be processed.
+        pre_process_params (dict): Pre-processing parameters.
+
+    Yields:
+        structure.BrainImage: The processed images.
+    """
+    if pre_process_params is None:
+        pre_process_params = {}
+
+    for id_, path in data_batch.items():
+        yield pre_process(id_, path, **pre_process_params)
+
+
 def post_process_batch(brain_images: t.List[structure.BrainImage], segmentations: t.List[sitk.Image],
                        probabilities: t.List[sitk.Image], post_process_params: dict = None,
                        multi_process: bool = True) -> t.List[sitk.Image]:
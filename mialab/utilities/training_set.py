@@ -0,0 +1,157 @@
+"""This module contains builders of the training set: a streaming reservoir sampler, whose memory is independent of
+the number of subjects, and an uncertainty-driven active selection of the training rows."""
+import typing as t
+
+import numpy as np
+import sklearn.ensemble as sk_ensemble
+
+
+class ReservoirTrainingSet:
+    """Represents a training set, which keeps a fixed-size uniform random sample of the rows of each label.
+
+    The feature matrices of the subjects are added one by one. The rows of each label are reservoir sampled (algorithm
+    R) into a preallocated float32 buffer, such that each row seen so far is kept with the same probability and the
+    feature matrix of a subject can be released as soon as it is added.
+    """
+
+    def __init__(self, labels: t.Sequence[int], reservoir_sizes: t.Sequence[int], rng: np.random.Generator = None):
+        """Initializes a new instance of the ReservoirTrainingSet class.
+
+        Args:
+            labels (Sequence[int]): The labels, e.g. [0, 1, 2, 3, 4, 5]. Rows of other labels are ignored.
+            reservoir_sizes (Sequence[int]): The maximum number of rows of a corresponding label.
+            rng (np.random.Generator): The random number generator. If None, a generator is seeded from the global
+                NumPy random state.
+        """
+        if len(labels) != len(reservoir_sizes):
+            raise ValueError('a reservoir size is required for each label')
+        if any(size < 0 for size in reservoir_sizes):
+            raise ValueError('the reservoir sizes need to be non-negative')
+
+        self.labels = list(labels)
+        self.reservoir_sizes = [int(size) for size in reservoir_sizes]
+        self.rng = rng if rng is not None else np.random.default_rng(np.random.randint(2 ** 32, dtype=np.uint64))
+
+        # the reservoir of each label is a contiguous part of the buffer, allocated with the first feature matrix
+        self.offsets = np.concatenate([[0], np.cumsum(self.reservoir_sizes)]).astype(int)
+        self.data = None
+        self.seen = [0] * len(self.labels)  # the number of rows of each label added so far
+        self.feature_names = []
+
+    def add(self, data: np.ndarray, labels: np.ndarray, feature_names: t.List[str] = None):
+        """Adds the feature matrix of a subject.
+
+        Args:
+            data (np.ndarray): The features of shape (n, number of features).
+            labels (np.ndarray): The labels of shape (n,) or (n, 1).
+            feature_names (List[str]): The names of the features, e.g. ``BrainImage.feature_names``.
+        """
+        labels = np.asarray(labels).reshape(-1)
+        if self.data is None:
+            self.data = np.empty((self.offsets[-1], data.shape[1]), dtype=np.float32)
+            self.feature_names = list(feature_names or [])
+        elif data.shape[1] != self.data.shape[1]:
+            raise ValueError('the feature matrix has {} features, but {} are expected'.format(data.shape[1],
+                                                                                              self.data.shape[1]))
+
+        for label_idx, label in enumerate(self.labels):
+            rows = np.flatnonzero(labels == label)
+            size = self.reservoir_sizes[label_idx]
+            seen = self.seen[label_idx]
+            self.seen[label_idx] += rows.size
+            if size == 0 or rows.size == 0:
+                continue
+
+            reservoir = self.data[self.offsets[label_idx]:self.offsets[label_idx + 1]]
+
+            # fill the free slots
+            no_free = max(0, min(size - seen, rows.size))
+            reservoir[seen:seen + no_free] = data[rows[:no_free]]
+
+            # the i-th row seen replaces a random slot with probability size / (i + 1)
+            rows = rows[no_free:]
+            slots = self.rng.integers(0, np.arange(seen + no_free, seen + no_free + rows.size) + 1)
+            replacing = slots < size
+            rows, slots = rows[replacing], slots[replacing]
+            # a slot replaced several times keeps the last row
+            slots_reversed, last = np.unique(slots[::-1], return_index=True)
+            reservoir[slots_reversed] = data[rows[::-1][last]]
+
+    def get(self) -> t.Tuple[np.ndarray, np.ndarray]:
+        """Gets the training set.
+
+        Returns:
+            tuple: The features of shape (n, number of features) and the labels of shape (n,), the features are a view
+            of the buffer if all reservoirs are full.
+        """
+        if self.data is None:
+            raise ValueError('no feature matrix has been added')
+
+        counts = [min(size, seen) for size, seen in zip(self.reservoir_sizes, self.seen)]
+        labels = np.repeat(self.labels, counts).astype(np.int16)
+        if counts == self.reservoir_sizes:
+            return self.data, labels
+
+        rows = np.concatenate([np.arange(offset, offset + count) for offset, count in zip(self.offsets, counts)])
+        return self.data[rows], labels
+
+
+def select_active_training_rows(data: np.ndarray, labels: np.ndarray, row_budget: int, seed_size: int,
+                                step_size: int, n_estimators: int, max_depth: int,
+                                rng: np.random.Generator) -> np.ndarray:
+    """Selects the training rows by uncertainty-driven active resampling.
+
+    A small forest is fit on a random seed sample of each label and scores the remaining candidate rows by the entropy
+    of its predicted probabilities. The candidates with the highest entropy are added per label and the forest is fit
+    again, until the row budget is reached.
+
+    Args:
+        data (np.ndarray): The feature matrix of the candidate rows.
+        labels (np.ndarray): The labels of the candidate rows.
+        row_budget (int): The number of rows to select.
+        seed_size (int): The number of random rows per label of the seed sample, reduced such that the seed sample
+            does not exceed the row budget.
+        step_size (int): The number of rows per label added in each round.
+        n_estimators (int): The number of trees of the small forest.
+        max_depth (int): The maximum depth of the trees of the small forest.
+        rng (np.random.Generator): The random number generator.
+
+    Returns:
+        np.ndarray: The indices of the selected rows.
+    """
+    if step_size < 1:
+        raise ValueError('the step size needs to be at least 1')
+
+    label_values = np.unique(labels)
+    row_budget = min(row_budget, labels.size)
+
+    # the seed sample is part of the budget
+    seed_size = min(seed_size, max(1, row_budget // max(1, label_values.size)))
+    selected = np.zeros(labels.size, dtype=bool)
+    for label in label_values:
+        label_rows = np.flatnonzero(labels == label)
+        selected[rng.choice(label_rows, min(seed_size, label_rows.size), replace=False)] = True
+    if np.count_nonzero(selected) > row_budget:
+        # fewer rows than labels
+        selected[rng.choice(np.flatnonzero(selected), np.count_nonzero(selected) - row_budget, replace=False)] = False
+
+    while np.count_nonzero(selected) < row_budget:
+        forest = sk_ensemble.RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth,
+                                                    random_state=int(rng.integers(2 ** 31)))
+        forest.fit(data[selected], labels[selected])
+
+        candidates = np.flatnonzero(~selected)
+        probabilities = forest.predict_proba(data[candidates])
+        entropy = -np.sum(probabilities * np.log(np.clip(probabilities, 1e-12, 1)), axis=1)
+
+        remaining = row_budget - np.count_nonzero(selected)
+        for label in label_values:
+            label_candidates = np.flatnonzero(labels[candidates] == label)
+            no_rows = min(step_size, label_candidates.size, remaining)
+            if no_rows > 0:
+                most_uncertain = np.argpartition(entropy[label_candidates], -no_rows)[-no_rows:]
+                selected[candidates[label_candidates[most_uncertain]]] = True
+                remaining -= no_rows
+        print(' Active resampling: {} of {} rows'.format(np.count_nonzero(selected), row_budget))
+
+    return np.flatnonzero(selected)